@@ -2,22 +2,35 @@
 """PySide6 peer-to-peer LAN messenger with multi-room support and per-room buffers."""
 
 import argparse
-import queue
+import heapq
 import socket
-import uuid
+import threading
+import secrets
 import time
 import sys
 from collections import deque
 from dataclasses import dataclass
 from typing import Optional
-from p2p_server import BroadcastPeer, DiscoveryService, RoomEntry
+from p2p_server import BroadcastPeer, RelayPeer, DiscoveryService, RoomEntry, is_udp_port_available
 
 AUTO_ROOM_PORT = 4242
 AUTO_ROOM_NAME = "42 Global"
 AUTO_ROOM_CODE = ""
-
-from PySide6.QtCore import Qt, QTimer
-from PySide6.QtGui import QColor, QTextCursor
+POLL_BATCH = 64
+MAX_TRANSCRIPT_LINES = 5000
+TYPING_IDLE_MS = 3000
+# Keystrokes within this window are handled as one typing update.
+TYPING_FLUSH_MS = 50
+ROOM_ANNOUNCE_MS = 8000
+# Defaults in seconds; presence and typing timeouts can be overridden on the command line.
+PRESENCE_TIMEOUT = 20.0
+TYPING_TIMEOUT = 5.0
+TYPING_RESEND = 1.5
+# A port found unavailable is not probed again for this long.
+PORT_PROBE_RETRY = 2.0
+
+from PySide6.QtCore import QSignalBlocker, QSocketNotifier, Qt, QThreadPool, QTimer
+from PySide6.QtGui import QBrush, QColor, QTextCursor, QTextDocument
 from PySide6.QtWidgets import (
     QApplication,
     QDialog,
@@ -45,21 +58,29 @@ class SessionState:
     room: str
     code: str
     peer: "BroadcastPeer"
-    buffer: list[str]
-    presence: dict[str, dict]
+    document: QTextDocument
+    # Presence is split by field so the stale sweep only walks timestamps.
+    presence_names: dict[str, str]
+    presence_last: dict[str, float]
     typing_states: dict[str, float]
-    outgoing_times: deque
+    outgoing_times: list[float]
+    outgoing_head: int
     send_penalty_until: float
     last_typing_sent: float
-    last_typing_activity: float
     is_typing: bool
-    last_room_announce: float
     connected: bool = False
+    # Single-shot deadline: fires once after TYPING_IDLE_MS without keystrokes.
+    typing_timer: Optional[QTimer] = None
 
 
 class MessengerWindow(QMainWindow):
     """PySide6 UI that chats with multiple rooms; each room has its own session and buffer."""
 
+    # Room list brushes, built once; items share them instead of wrapping a QColor per call.
+    _COL_ACTIVE = QBrush(QColor("#0b3d91"))
+    _COL_CONNECTED = QBrush(QColor("#228b22"))
+    _COL_DEFAULT = QBrush(QColor("black"))
+
     def __init__(
         self,
         default_port: int = AUTO_ROOM_PORT,
@@ -67,48 +88,103 @@ class MessengerWindow(QMainWindow):
         default_room: str = AUTO_ROOM_NAME,
         default_code: str = AUTO_ROOM_CODE,
         relay: str = "",
+        presence_timeout: float = PRESENCE_TIMEOUT,
+        typing_timeout: float = TYPING_TIMEOUT,
     ) -> None:
         super().__init__()
         self.setWindowTitle("LAN Messenger (PySide6)")
         self.resize(1200, 800)
 
-        self.messages = queue.Queue()
-        self.peer_id = uuid.uuid4().hex[:8]
-
-self.relay_host = ""
-self.relay_port = 9000
-if relay:
-    if ":" in relay:
-        h, p = relay.rsplit(":", 1)
-        self.relay_host = h.strip()
-        try:
-            self.relay_port = int(p.strip())
-        except ValueError:
-            self.relay_port = 9000
-    else:
-        self.relay_host = relay.strip()
+        # deque.append/popleft are atomic, so network threads can feed the UI without a lock.
+        self.messages: deque = deque()
+        # Self-pipe wakeup: producers write a byte, Qt's event loop watches the read end.
+        # A socketpair rather than os.pipe so the notifier also works on Windows.
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._notifier = QSocketNotifier(self._wake_r.fileno(), QSocketNotifier.Read, self)
+        self._notifier.activated.connect(self._on_wake)
+        # Only the first producer since the last drain writes, so bursts cost one send().
+        self._wake_lock = threading.Lock()
+        self._wake_pending = False
+        # Non-"msg" events are ("kind", *args) and dispatch to handler(*args, now); "msg" lines are batched.
+        self._evt_handlers = {
+            "presence": self._on_presence,
+            "typing": self._on_typing,
+            "rooms": self._on_rooms_changed,
+            "port": self._on_port_probed,
+        }
+        # Port probes bind a socket, so they run on the pool and report back through _post.
+        self._port_probe_pool = QThreadPool.globalInstance()
+        self._port_unavailable: dict[int, float] = {}  # port -> monotonic time the cached failure expires
+        self._port_waiters: dict[int, list] = {}
+        self.peer_id = secrets.token_hex(4)
+        self.presence_timeout = presence_timeout
+        self.typing_timeout = typing_timeout
+
+        self.relay_host = ""
+        self.relay_port = 9000
+        if relay:
+            if ":" in relay:
+                h, p = relay.rsplit(":", 1)
+                self.relay_host = h.strip()
+                try:
+                    self.relay_port = int(p.strip())
+                except ValueError:
+                    self.relay_port = 9000
+            else:
+                self.relay_host = relay.strip()
 
         self.port_value = str(default_port)
         self.room_value = default_room
         self.code_value = default_code
         self.name_value = default_name
 
+        # Set by the discovery callback, cleared by the GUI thread just before it re-reads rooms.
+        self._rooms_pending = False
         self.discovery = DiscoveryService(self.peer_id, self._queue_rooms_update)
         self.discovery.start()
 
-        self.rooms: list[RoomEntry] = []
+        # Keyed by (name, port, creator); insertion order is display order.
+        self.rooms: dict[tuple[str, int, str], RoomEntry] = {}
+        # Discovery generation self.rooms was built from; -1 forces the first read.
+        self._rooms_gen = -1
+        self._room_items: dict[tuple[str, int, str], QListWidgetItem] = {}
+        # (label, colour) last applied to each item, and the inputs of the last full restyle.
+        self._room_styles: dict[tuple[str, int, str], tuple[str, QBrush]] = {}
+        self._room_sig: Optional[tuple] = None
+        # Items taken out of the room list, recycled for rooms that appear later.
+        self._item_pool: list[QListWidgetItem] = []
         self.sessions: dict[tuple[int, str, str], SessionState] = {}
         self.current_session_key: Optional[tuple[int, str, str]] = None
         self.connected_ids: set[tuple[int, str]] = set()
+        # (port, room) -> session key, so selecting a room finds its session without a scan.
+        self._session_by_pr: dict[tuple[int, str], tuple[int, str, str]] = {}
+        # Announce entries for connected sessions, built once at connect for the re-announce timer.
+        self._advertised: dict[tuple[int, str, str], RoomEntry] = {}
+        self._create_room_dialog: Optional[QDialog] = None
+        # Session whose typing update is waiting for the coalesced flush, if any.
+        self._typing_flush_key: Optional[tuple[int, str, str]] = None
 
         self._build_ui()
         self._maybe_create_default_room()
         self._refresh_rooms_from_discovery()
         self.discovery.request_rooms()
 
-        self.poll_timer = QTimer(self)
-        self.poll_timer.timeout.connect(self._poll_messages)
-        self.poll_timer.start(100)
+        # Events arrive through the bridge and per-session deadlines have their own timers.
+        # All connected rooms are re-advertised together so one batched send covers them.
+        self._announce_timer = QTimer(self)
+        self._announce_timer.timeout.connect(self._announce_sessions)
+        self._announce_timer.start(ROOM_ANNOUNCE_MS)
+        # Presence/typing expiry is kept in min-heaps of (expires_at, session_key, peer_id);
+        # entries renewed since they were pushed are skipped when popped. The single-shot
+        # sweep timer is armed for the earliest head, so nothing runs while nothing expires.
+        self._presence_expiry: list[tuple[float, tuple[int, str, str], str]] = []
+        self._typing_expiry: list[tuple[float, tuple[int, str, str], str]] = []
+        self._sweep_deadline = 0.0
+        self._sweep_timer = QTimer(self)
+        self._sweep_timer.setSingleShot(True)
+        self._sweep_timer.timeout.connect(self._sweep_stale)
 
     # ---------------- UI -----------------
     def _build_ui(self) -> None:
@@ -172,6 +248,9 @@ if relay:
         top_row.addWidget(QLabel("Nickname"))
         self.name_entry = QLineEdit(self.name_value)
         self.name_entry.setFixedWidth(180)
+        # Our own typing label reads the nickname from here instead of the line edit.
+        self._display_name = self.name_value.strip() or "Me"
+        self.name_entry.textChanged.connect(self._on_name_changed)
         top_row.addWidget(self.name_entry)
         top_row.addSpacing(18)
 
@@ -216,49 +295,94 @@ if relay:
 
     # -------- Room list & selection ---------
     def _queue_rooms_update(self) -> None:
-        self.messages.put(("rooms",))
+        # Any number of discovery changes before the next drain need only one refresh.
+        if self._rooms_pending:
+            return
+        self._rooms_pending = True
+        self._post(("rooms",))
 
     def _refresh_rooms_from_discovery(self) -> None:
-        self.rooms = sorted(
-            self.discovery.get_rooms(), key=lambda r: (r.port, r.name.lower(), r.creator)
-        )
+        """Apply only the difference between the discovered rooms and the list widget."""
+        gen, snapshot = self.discovery.get_rooms_if_changed(self._rooms_gen)
+        if snapshot is None:
+            return
+        self._rooms_gen = gen
+        rooms = {(r.name, r.port, r.creator): r for r in snapshot}
+        items = self._room_items
+        pool = self._item_pool
+        blocker = QSignalBlocker(self.room_list)
+        try:
+            for rkey in [k for k in items if k not in rooms]:
+                pool.append(self.room_list.takeItem(self.room_list.row(items.pop(rkey))))
+                self._room_styles.pop(rkey, None)
+            # The snapshot is sorted and surviving rows keep their relative order,
+            # so each new room goes in at its index in the fresh ordering.
+            for row, rkey in enumerate(rooms):
+                if rkey not in items:
+                    item = pool.pop() if pool else QListWidgetItem()
+                    item.setData(Qt.UserRole, rkey)
+                    self.room_list.insertItem(row, item)
+                    items[rkey] = item
+        finally:
+            blocker.unblock()
+        self.rooms = rooms
         self._refresh_room_list()
 
     def _refresh_room_list(self) -> None:
-        self.room_list.blockSignals(True)
-        self.room_list.clear()
+        """Update labels and colours in place; rows are added/removed by the discovery refresh."""
         active_id = self.current_session_key[:2] if self.current_session_key else None
-        connected_ids = set(self.connected_ids)
-        for room in self.rooms:
-            privacy = "private" if room.private else "public"
-            suffix = " [mine]" if room.creator == self.peer_id else ""
-            label = f"{room.name} @ {room.port} ({privacy}){suffix}"
-            item = QListWidgetItem(label)
-            rid = (room.port, room.name)
-            if active_id and rid == active_id:
-                item.setForeground(QColor("#0b3d91"))
-            elif rid in connected_ids:
-                item.setForeground(QColor("#228b22"))
-            else:
-                item.setForeground(QColor("black"))
-            self.room_list.addItem(item)
-        self.room_list.blockSignals(False)
+        connected_ids = self.connected_ids
+        sig = (
+            tuple((rkey, room.private) for rkey, room in self.rooms.items()),
+            active_id,
+            frozenset(connected_ids),
+        )
+        if sig == self._room_sig:
+            return
+        self._room_sig = sig
+        styles = self._room_styles
+        blocker = QSignalBlocker(self.room_list)
+        try:
+            for rkey, room in self.rooms.items():
+                privacy = "private" if room.private else "public"
+                suffix = " [mine]" if room.creator == self.peer_id else ""
+                label = f"{room.name} @ {room.port} ({privacy}){suffix}"
+                rid = (room.port, room.name)
+                if active_id and rid == active_id:
+                    colour = self._COL_ACTIVE
+                elif rid in connected_ids:
+                    colour = self._COL_CONNECTED
+                else:
+                    colour = self._COL_DEFAULT
+                style = (label, colour)
+                if styles.get(rkey) == style:
+                    continue
+                styles[rkey] = style
+                item = self._room_items[rkey]
+                item.setText(label)
+                item.setForeground(colour)
+        finally:
+            blocker.unblock()
+
+    def _selected_room(self) -> Optional[RoomEntry]:
+        item = self.room_list.currentItem()
+        rkey = item.data(Qt.UserRole) if item is not None else None
+        # Qt hands sequences back as lists; the dict is keyed by tuples.
+        return self.rooms.get(tuple(rkey)) if rkey else None
 
     def _on_room_select(self, _current, _previous=None) -> None:
-        idx = self.room_list.currentRow()
-        if idx < 0 or idx >= len(self.rooms):
+        room = self._selected_room()
+        if room is None:
             return
-        room = self.rooms[idx]
         self.port_value = str(room.port)
         self.room_value = room.name
         self.port_label.setText(self.port_value)
         self.room_label.setText(self.room_value)
         self._refresh_participants_display()
         self._refresh_room_list()
-        for key in self.sessions:
-            if (key[0], key[1]) == (room.port, room.name):
-                self._set_active_session(key)
-                return
+        key = self._session_by_pr.get((room.port, room.name))
+        if key is not None:
+            self._set_active_session(key)
 
     # ------------- Session helpers ---------------
     def _set_active_session(self, key: tuple[int, str, str]) -> None:
@@ -277,31 +401,72 @@ if relay:
         self._refresh_room_list()
 
     def _load_buffer(self, session: SessionState) -> None:
-        self.text_area.setPlainText("\n".join(session.buffer))
+        # Each session keeps its own laid-out document, so switching rooms is a swap.
+        self.text_area.setDocument(session.document)
+        self._scroll_to_end()
+
+    def _new_session_document(self) -> QTextDocument:
+        document = QTextDocument(self)
+        # Qt drops the oldest lines itself; no undo stack, since the transcript is append-only.
+        document.setMaximumBlockCount(MAX_TRANSCRIPT_LINES)
+        document.setUndoRedoEnabled(False)
+        return document
+
+    def _scroll_to_end(self) -> None:
         cursor = self.text_area.textCursor()
         cursor.movePosition(QTextCursor.MoveOperation.End)
         self.text_area.setTextCursor(cursor)
 
     def _append_to_session(self, key: tuple[int, str, str], message: str) -> None:
+        self._append_lines_to_session(key, [message])
+
+    def _append_lines_to_session(self, key: tuple[int, str, str], lines: list[str]) -> None:
+        """Append several lines with a single QTextEdit update for the visible session."""
         session = self.sessions.get(key)
         if not session:
             return
-        session.buffer.append(message)
+        cursor = QTextCursor(session.document)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        # One edit block: the document emits a single change and relayouts once.
+        cursor.beginEditBlock()
+        if not session.document.isEmpty():
+            cursor.insertBlock()
+        cursor.insertText("\n".join(lines))
+        cursor.endEditBlock()
         if key == self.current_session_key:
-            self.text_area.append(message)
-            cursor = self.text_area.textCursor()
-            cursor.movePosition(QTextCursor.MoveOperation.End)
-            self.text_area.setTextCursor(cursor)
+            self._scroll_to_end()
 
     # ------------- Networking callbacks -------------
     def _handle_peer_message(self, key: tuple[int, str, str], message: str) -> None:
-        self.messages.put(("msg", key, message))
+        self._post(("msg", key, message))
 
     def _handle_peer_presence(self, key: tuple[int, str, str], peer_id: str, name: str) -> None:
-        self.messages.put(("presence", key, peer_id, name))
+        self._post(("presence", key, peer_id, name))
 
     def _handle_peer_typing(self, key: tuple[int, str, str], peer_id: str, name: str, active: bool) -> None:
-        self.messages.put(("typing", key, peer_id, name, active))
+        self._post(("typing", key, peer_id, name, active))
+
+    def _post(self, evt: tuple) -> None:
+        """Queue an event from any thread and wake the GUI thread to drain it."""
+        self.messages.append(evt)
+        with self._wake_lock:
+            if self._wake_pending:
+                return
+            self._wake_pending = True
+        try:
+            self._wake_w.send(b"\x01")
+        except OSError:
+            pass  # closed while shutting down
+
+    def _on_wake(self, *_args) -> None:
+        # Cleared before draining, so an event queued after this point writes a new byte.
+        with self._wake_lock:
+            self._wake_pending = False
+        try:
+            self._wake_r.recv(4096)
+        except OSError:
+            pass
+        self._drain_messages()
 
     # ------------- Connect / Disconnect -------------
     def _connect(self) -> None:
@@ -323,18 +488,16 @@ if relay:
             self._set_active_session(key)
             return
 
-        
-PeerCls = RelayPeer if self.relay_host else BroadcastPeer
-peer = PeerCls(
-    peer_id=self.peer_id,
-    session_key=key,
-    on_message=self._handle_peer_message,
-    on_presence=self._handle_peer_presence,
-    on_typing=self._handle_peer_typing,
-    **({"relay_host": self.relay_host, "relay_port": self.relay_port} if self.relay_host else {}),
-)
-try:
-
+        PeerCls = RelayPeer if self.relay_host else BroadcastPeer
+        peer = PeerCls(
+            peer_id=self.peer_id,
+            session_key=key,
+            on_message=self._handle_peer_message,
+            on_presence=self._handle_peer_presence,
+            on_typing=self._handle_peer_typing,
+            **({"relay_host": self.relay_host, "relay_port": self.relay_port} if self.relay_host else {}),
+        )
+        try:
             peer.start(name, port, room, code)
         except OSError as exc:
             QMessageBox.critical(self, "Could not start", f"Failed to bind port: {exc}")
@@ -346,20 +509,25 @@ try:
             room=room,
             code=code,
             peer=peer,
-            buffer=[],
-            presence={},
+            document=self._new_session_document(),
+            presence_names={},
+            presence_last={},
             typing_states={},
-            outgoing_times=deque(),
+            outgoing_times=[float("-inf")] * peer.flood_limit_count,
+            outgoing_head=0,
             send_penalty_until=0.0,
             last_typing_sent=0.0,
-            last_typing_activity=0.0,
             is_typing=False,
-            last_room_announce=time.time(),
             connected=True,
         )
-        session.presence[self.peer_id] = {"name": name, "last": time.time()}
+        self._start_session_timers(session)
+        # Our own entry is never scheduled for expiry; it lasts as long as the session.
+        session.presence_names[self.peer_id] = name
+        session.presence_last[self.peer_id] = time.monotonic()
         self.sessions[key] = session
         self.connected_ids.add((port, room))
+        self._session_by_pr[(port, room)] = key
+        self._advertised[key] = self._session_room_entry(session)
         self._set_active_session(key)
         self._broadcast_room_advertisement(session)
         self._append_to_session(key, "Connected. Peers on this port/room will see your messages.")
@@ -371,15 +539,21 @@ try:
             return
         key = self.current_session_key
         session = self.sessions.pop(key, None)
+        self._advertised.pop(key, None)
         if session:
+            self._stop_session_timers(session)
             session.peer.send_typing(False)
             session.peer.stop(announce=True)
         self.connected_ids.discard((key[0], key[1]))
+        if self._session_by_pr.get((key[0], key[1])) == key:
+            del self._session_by_pr[(key[0], key[1])]
         self.current_session_key = None
         self.status_label.setText("Disconnected")
         self.participants_list.clear()
         self.typing_label.setText("")
-        self.text_area.clear()
+        self.text_area.setDocument(QTextDocument(self.text_area))
+        if session:
+            session.document.deleteLater()
         self._update_ui_state()
         self._refresh_room_list()
 
@@ -392,7 +566,7 @@ try:
         if not session or not session.connected:
             QMessageBox.warning(self, "Not connected", "Connect to a room first.")
             return
-        now = time.time()
+        now = time.monotonic()
         if now < session.send_penalty_until:
             wait = int(session.send_penalty_until - now) + 1
             self._append_to_session(session.key, f"Flood control: wait {wait}s before sending.")
@@ -400,55 +574,65 @@ try:
         message = self.message_entry.text().strip()
         if not message:
             return
-        self._prune_outgoing(session, now)
-        if len(session.outgoing_times) >= session.peer.flood_limit_count:
+        if not self._admit_outgoing(session, now):
             session.send_penalty_until = now + session.peer.flood_penalty_seconds
             self._append_to_session(session.key, "Flood control: 10s cooldown applied.")
             return
-        session.outgoing_times.append(now)
         session.peer.send_chat(message)
         session.is_typing = False
+        session.typing_timer.stop()
+        if self._typing_flush_key == session.key:
+            self._typing_flush_key = None  # the pending flush must not re-announce typing
         session.peer.send_typing(False)
         self._append_to_session(session.key, f"Me: {message}")
         self.message_entry.clear()
-        session.last_typing_activity = 0.0
 
-    def _prune_outgoing(self, session: SessionState, now: float) -> None:
-        while session.outgoing_times and now - session.outgoing_times[0] > session.peer.flood_limit_window:
-            session.outgoing_times.popleft()
+    def _admit_outgoing(self, session: SessionState, now: float) -> bool:
+        """Record a send in the ring unless flood_limit_count sends already fall inside the window."""
+        head = session.outgoing_head
+        if now - session.outgoing_times[head] <= session.peer.flood_limit_window:
+            return False
+        session.outgoing_times[head] = now
+        session.outgoing_head = (head + 1) % len(session.outgoing_times)
+        return True
 
     # ------------- Typing UI -------------
     def _typing_event(self, _text: str) -> None:
-        if not self.current_session_key:
+        if not self.current_session_key or self._typing_flush_key is not None:
             return
-        session = self.sessions.get(self.current_session_key)
+        self._typing_flush_key = self.current_session_key
+        QTimer.singleShot(TYPING_FLUSH_MS, self._flush_typing)
+
+    def _flush_typing(self) -> None:
+        key, self._typing_flush_key = self._typing_flush_key, None
+        session = self.sessions.get(key)
         if not session:
             return
         session.is_typing = True
-        session.last_typing_activity = time.time()
-        if time.time() - session.last_typing_sent > 1.5:
+        session.typing_timer.start()
+        now = time.monotonic()
+        if now - session.last_typing_sent > TYPING_RESEND:
             session.peer.send_typing(True)
-            session.last_typing_sent = time.time()
+            session.last_typing_sent = now
+
+    def _on_name_changed(self, text: str) -> None:
+        self._display_name = text.strip() or "Me"
 
     def _refresh_typing_display(self, session: Optional[SessionState] = None) -> None:
         session = session or (self.sessions.get(self.current_session_key) if self.current_session_key else None)
         if not session:
             self.typing_label.setText("")
             return
-        now = time.time()
-        stale = [pid for pid, ts in session.typing_states.items() if now - ts > 5]
-        for pid in stale:
-            session.typing_states.pop(pid, None)
         if not session.typing_states:
             self.typing_label.setText("")
             return
-        peers = session.presence
+        peers = session.presence_names
         names = []
         for pid in session.typing_states:
             if pid == self.peer_id:
-                names.append(self.name_entry.text().strip() or "Me")
+                names.append(self._display_name)
             elif pid in peers:
-                names.append(peers[pid]["name"])
+                names.append(peers[pid])
         names = [n for n in names if n]
         if not names:
             self.typing_label.setText("")
@@ -460,20 +644,28 @@ try:
             self.typing_label.setText(f"{listed} are typing...")
 
     # ------------- Presence & typing callbacks -------------
-    def _on_presence(self, key: tuple[int, str, str], peer_id: str, name: str) -> None:
+    def _on_presence(self, key: tuple[int, str, str], peer_id: str, name: str, now: float) -> None:
         session = self.sessions.get(key)
         if not session:
             return
-        session.presence[peer_id] = {"name": name, "last": time.time()}
+        known = session.presence_names.get(peer_id)
+        session.presence_last[peer_id] = now
+        self._schedule_expiry(self._presence_expiry, now, self.presence_timeout, key, peer_id)
+        if known == name:
+            return
+        session.presence_names[peer_id] = name
         if key == self.current_session_key:
-            self._refresh_participants_display()
+            if known is not None:
+                self._remove_participant(peer_id)
+            self._insert_participant(peer_id, name)
 
-    def _on_typing(self, key: tuple[int, str, str], peer_id: str, name: str, active: bool) -> None:
+    def _on_typing(self, key: tuple[int, str, str], peer_id: str, name: str, active: bool, now: float) -> None:
         session = self.sessions.get(key)
         if not session:
             return
         if active:
-            session.typing_states[peer_id] = time.time()
+            session.typing_states[peer_id] = now
+            self._schedule_expiry(self._typing_expiry, now, self.typing_timeout, key, peer_id)
         else:
             session.typing_states.pop(peer_id, None)
         if key == self.current_session_key:
@@ -486,77 +678,123 @@ try:
         session = self.sessions.get(self.current_session_key)
         if not session:
             return
-        now = time.time()
-        stale = [pid for pid, data in session.presence.items() if now - data.get("last", 0) > 20]
-        for pid in stale:
-            session.presence.pop(pid, None)
-        peers = session.presence
-        items = sorted(peers.items(), key=lambda item: (item[1]["name"].lower(), item[0]))
-        for _, data in items:
-            self.participants_list.addItem(data["name"])
-
-    # ------------- Poll loop -------------
-    def _poll_messages(self) -> None:
-        while True:
+        items = sorted(session.presence_names.items(), key=lambda item: (item[1].lower(), item[0]))
+        for pid, name in items:
+            item = QListWidgetItem(name)
+            item.setData(Qt.UserRole, pid)
+            self.participants_list.addItem(item)
+
+    def _insert_participant(self, peer_id: str, name: str) -> None:
+        """Add one row at its sorted position instead of rebuilding the list."""
+        order = (name.lower(), peer_id)
+        row = 0
+        count = self.participants_list.count()
+        while row < count:
+            item = self.participants_list.item(row)
+            if (item.text().lower(), item.data(Qt.UserRole)) > order:
+                break
+            row += 1
+        item = QListWidgetItem(name)
+        item.setData(Qt.UserRole, peer_id)
+        self.participants_list.insertItem(row, item)
+
+    def _remove_participant(self, peer_id: str) -> None:
+        for row in range(self.participants_list.count()):
+            if self.participants_list.item(row).data(Qt.UserRole) == peer_id:
+                self.participants_list.takeItem(row)
+                return
+
+    # ------------- Event drain -------------
+    def _drain_messages(self) -> None:
+        """Handle at most POLL_BATCH queued events, then yield back to the Qt event loop."""
+        events = []
+        for _ in range(POLL_BATCH):
             try:
-                evt = self.messages.get_nowait()
-            except queue.Empty:
+                events.append(self.messages.popleft())
+            except IndexError:
                 break
-            kind = evt[0]
-            if kind == "msg":
-                _, key, msg = evt
-                self._append_to_session(key, msg)
-            elif kind == "presence":
-                _, key, pid, name = evt
-                self._on_presence(key, pid, name)
-            elif kind == "typing":
-                _, key, pid, name, active = evt
-                self._on_typing(key, pid, name, active)
-            elif kind == "rooms":
-                self._refresh_rooms_from_discovery()
-
-        self._cleanup_presence_typing()
-        now = time.time()
-        if self.current_session_key:
-            session = self.sessions.get(self.current_session_key)
-            if session:
-                if session.is_typing and now - session.last_typing_activity > 3:
-                    session.peer.send_typing(False)
-                    session.is_typing = False
-                self._refresh_typing_display(session)
-        for session in list(self.sessions.values()):
-            if not session.connected:
-                continue
-            if now - session.last_room_announce > 8:
-                self._broadcast_room_advertisement(session)
-                session.last_room_announce = now
+        else:
+            QTimer.singleShot(0, self._drain_messages)
+        batches: dict[tuple[int, str, str], list[str]] = {}
+        for evt in events:
+            if evt[0] == "msg":
+                batches.setdefault(evt[1], []).append(evt[2])
+        for key, lines in batches.items():
+            self._append_lines_to_session(key, lines)
+        handlers = self._evt_handlers
+        now = time.monotonic()
+        for evt in events:
+            handler = handlers.get(evt[0])
+            if handler is not None:
+                handler(*evt[1:], now)
+
+    def _on_rooms_changed(self, _now: float) -> None:
+        self._rooms_pending = False
+        self._refresh_rooms_from_discovery()
+
+    # ------------- Session timers -------------
+    def _start_session_timers(self, session: SessionState) -> None:
+        key = session.key
+        session.typing_timer = QTimer(self)
+        session.typing_timer.setSingleShot(True)
+        session.typing_timer.setInterval(TYPING_IDLE_MS)
+        session.typing_timer.timeout.connect(lambda: self._expire_typing(key))
+
+    def _stop_session_timers(self, session: SessionState) -> None:
+        if session.typing_timer is not None:
+            session.typing_timer.stop()
+            session.typing_timer.deleteLater()
+            session.typing_timer = None
+
+    def _expire_typing(self, key: tuple[int, str, str]) -> None:
+        session = self.sessions.get(key)
+        if session and session.is_typing:
+            session.peer.send_typing(False)
+            session.is_typing = False
+
+    def _announce_sessions(self) -> None:
+        if self._advertised:
+            self.discovery.announce_rooms(list(self._advertised.values()))
 
     # ------------- Room advertisement -------------
     def _broadcast_room_advertisement(self, session: SessionState) -> None:
-        room_entry = RoomEntry(
+        self.discovery.announce_room(self._advertised[session.key])
+
+    def _session_room_entry(self, session: SessionState) -> RoomEntry:
+        return RoomEntry(
             name=session.room,
             port=session.port,
             private=bool(session.code),
             creator=self.peer_id,
         )
-        self.discovery.announce_room(room_entry)
 
-    def _port_is_available(self, port: int) -> bool:
-        test_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            test_sock.bind(("", port))
-            return True
-        except OSError:
-            return False
-        finally:
-            try:
-                test_sock.close()
-            except OSError:
-                pass
+    def _probe_port(self, port: int, callback) -> None:
+        """Check off the GUI thread whether port can be bound; callback(ok) runs on the GUI thread."""
+        expires = self._port_unavailable.get(port)
+        if expires is not None:
+            if time.monotonic() < expires:
+                callback(False)
+                return
+            del self._port_unavailable[port]
+        waiters = self._port_waiters.get(port)
+        if waiters is not None:
+            waiters.append(callback)  # a probe for this port is already running
+            return
+        self._port_waiters[port] = [callback]
+        self._port_probe_pool.start(lambda: self._post(("port", port, is_udp_port_available(port))))
+
+    def _on_port_probed(self, port: int, ok: bool, now: float) -> None:
+        if not ok:
+            self._port_unavailable[port] = now + PORT_PROBE_RETRY
+        for callback in self._port_waiters.pop(port, ()):
+            callback(ok)
 
     def _maybe_create_default_room(self) -> None:
-        """Create and announce the default room if the port is free."""
-        if not self._port_is_available(AUTO_ROOM_PORT):
+        """Create and announce the default room once a probe finds the port free."""
+        self._probe_port(AUTO_ROOM_PORT, self._create_default_room)
+
+    def _create_default_room(self, ok: bool) -> None:
+        if not ok:
             print(f"[auto-room] Port {AUTO_ROOM_PORT} unavailable; default room not created.")
             return
         room = RoomEntry(
@@ -568,38 +806,54 @@ try:
             local=True,
         )
         self.discovery.add_local_room(room)
+        self._refresh_rooms_from_discovery()
 
     # ------------- Create/Delete room -------------
-    def _open_create_room(self) -> None:
+    def _build_create_room_dialog(self) -> QDialog:
+        """Build the Create Room dialog once; later opens only reset its fields."""
         dlg = QDialog(self)
         dlg.setWindowTitle("Create Room")
         form = QFormLayout(dlg)
 
-        port_edit = QLineEdit(self.port_value)
-        room_edit = QLineEdit(self.room_value)
-        code_edit = QLineEdit(self.code_entry.text())
+        self._create_port_edit = QLineEdit()
+        self._create_room_edit = QLineEdit()
+        self._create_code_edit = QLineEdit()
 
-        form.addRow("Port", port_edit)
-        form.addRow("Room name", room_edit)
-        form.addRow("Code (optional)", code_edit)
+        form.addRow("Port", self._create_port_edit)
+        form.addRow("Room name", self._create_room_edit)
+        form.addRow("Code (optional)", self._create_code_edit)
 
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dlg.accept)
         buttons.rejected.connect(dlg.reject)
         form.addRow(buttons)
+        return dlg
+
+    def _open_create_room(self) -> None:
+        if self._create_room_dialog is None:
+            self._create_room_dialog = self._build_create_room_dialog()
+        dlg = self._create_room_dialog
+        self._create_port_edit.setText(self.port_value)
+        self._create_room_edit.setText(self.room_value)
+        self._create_code_edit.setText(self.code_entry.text())
+        self._create_port_edit.setFocus()
 
         if dlg.exec() != QDialog.Accepted:
             return
 
-        room_name = room_edit.text().strip() or "public"
-        code = code_edit.text().strip()
+        room_name = self._create_room_edit.text().strip() or "public"
+        code = self._create_code_edit.text().strip()
         try:
-            port = int(port_edit.text().strip())
+            port = int(self._create_port_edit.text().strip())
         except ValueError:
             QMessageBox.critical(self, "Invalid port", "Port must be a number.")
             return
 
-        if not self._port_is_available(port):
+        # The dialog has closed; the room is created when the probe reports back.
+        self._probe_port(port, lambda ok: self._create_room(ok, port, room_name, code))
+
+    def _create_room(self, ok: bool, port: int, room_name: str, code: str) -> None:
+        if not ok:
             QMessageBox.critical(self, "Port unavailable", f"Port {port} cannot be bound on this host.")
             return
 
@@ -620,11 +874,10 @@ try:
         self.code_entry.setText(code)
 
     def _delete_room(self) -> None:
-        idx = self.room_list.currentRow()
-        if idx < 0 or idx >= len(self.rooms):
+        room = self._selected_room()
+        if room is None:
             QMessageBox.warning(self, "No selection", "Select a room to delete.")
             return
-        room = self.rooms[idx]
         if room.creator != self.peer_id:
             QMessageBox.warning(self, "Cannot delete", "Only the creator can delete this room.")
             return
@@ -632,18 +885,62 @@ try:
         self._refresh_rooms_from_discovery()
 
     # ------------- Cleanup / UI state -------------
-    def _cleanup_presence_typing(self) -> None:
-        now = time.time()
-        for session in self.sessions.values():
-            stale = [pid for pid, data in session.presence.items() if now - data.get("last", 0) > 20]
-            for pid in stale:
-                session.presence.pop(pid, None)
-            stale_typing = [pid for pid, ts in session.typing_states.items() if now - ts > 5]
-            for pid in stale_typing:
-                session.typing_states.pop(pid, None)
-        if self.current_session_key:
-            self._refresh_participants_display()
-            self._refresh_typing_display()
+    def _schedule_expiry(
+        self, heap: list, now: float, ttl: float, key: tuple[int, str, str], peer_id: str
+    ) -> None:
+        expires_at = now + ttl
+        heapq.heappush(heap, (expires_at, key, peer_id))
+        if not self._sweep_timer.isActive() or expires_at < self._sweep_deadline:
+            self._arm_sweep(now)
+
+    def _arm_sweep(self, now: float) -> None:
+        heads = [heap[0][0] for heap in (self._presence_expiry, self._typing_expiry) if heap]
+        if not heads:
+            self._sweep_timer.stop()
+            return
+        self._sweep_deadline = min(heads)
+        self._sweep_timer.start(max(0, int((self._sweep_deadline - now) * 1000) + 1))
+
+    def _sweep_stale(self) -> None:
+        """Pop expired heap entries; only touched rows and labels are updated."""
+        now = time.monotonic()
+        sessions = self.sessions
+        left: dict[tuple[int, str, str], set[str]] = {}
+        typing_changed: set[tuple[int, str, str]] = set()
+        heap = self._presence_expiry
+        while heap and heap[0][0] <= now:
+            _, key, pid = heapq.heappop(heap)
+            session = sessions.get(key)
+            ts = session.presence_last.get(pid) if session else None
+            if ts is not None and now - ts >= self.presence_timeout:
+                left.setdefault(key, set()).add(pid)
+        for key, gone in left.items():
+            session = sessions[key]
+            if len(gone) * 2 > len(session.presence_last):
+                # Mostly emptied (e.g. after a network drop): rebuilding is cheaper than
+                # many deletes and also releases the oversized tables.
+                session.presence_last = {p: t for p, t in session.presence_last.items() if p not in gone}
+                session.presence_names = {p: n for p, n in session.presence_names.items() if p not in gone}
+            else:
+                for pid in gone:
+                    del session.presence_last[pid]
+                    session.presence_names.pop(pid, None)
+        heap = self._typing_expiry
+        while heap and heap[0][0] <= now:
+            _, key, pid = heapq.heappop(heap)
+            session = sessions.get(key)
+            ts = session.typing_states.get(pid) if session else None
+            if ts is not None and now - ts >= self.typing_timeout:
+                del session.typing_states[pid]
+                typing_changed.add(key)
+        current = self.current_session_key
+        session = sessions.get(current) if current else None
+        if session:
+            for pid in left.get(current, ()):
+                self._remove_participant(pid)
+            if current in left or current in typing_changed:
+                self._refresh_typing_display(session)
+        self._arm_sweep(now)
 
     def _update_ui_state(self) -> None:
         has_current = self.current_session_key in self.sessions if self.current_session_key else False
@@ -653,11 +950,21 @@ try:
         self.connect_button.setEnabled(True)
 
     def closeEvent(self, event) -> None:  # type: ignore[override]
+        udp_peers = []
         for session in self.sessions.values():
-            session.peer.send_typing(False)
-            session.peer.stop(announce=True)
+            self._stop_session_timers(session)
+            if isinstance(session.peer, BroadcastPeer):
+                udp_peers.append(session.peer)
+            else:
+                session.peer.send_typing(False)
+                session.peer.stop(announce=True)
+        BroadcastPeer.stop_all(udp_peers)
         self.sessions.clear()
+        self._advertised.clear()
         self.discovery.stop()
+        self._notifier.setEnabled(False)
+        self._wake_r.close()
+        self._wake_w.close()
         super().closeEvent(event)
 
 
@@ -668,13 +975,21 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--code", default=AUTO_ROOM_CODE, help="Private code (must match to receive)")
     parser.add_argument("--name", default="", help="Display name")
     parser.add_argument("--relay", default="", help="Use TCP relay host:port (enables cross-campus mode)")
+    parser.add_argument(
+        "--presence-timeout", type=float, default=PRESENCE_TIMEOUT, help="Seconds before a silent peer is dropped"
+    )
+    parser.add_argument(
+        "--typing-timeout", type=float, default=TYPING_TIMEOUT, help="Seconds before a typing indicator expires"
+    )
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
     app = QApplication(sys.argv)
-    window = MessengerWindow(args.port, args.name, args.room, args.code)
+    window = MessengerWindow(
+        args.port, args.name, args.room, args.code, args.relay, args.presence_timeout, args.typing_timeout
+    )
     window.show()
     sys.exit(app.exec())
 
@@ -2,20 +2,46 @@
 """Tkinter peer-to-peer LAN messenger with multi-room support and per-room buffers."""
 
 import argparse
+import heapq
 import queue
-import socket
+import threading
 import tkinter as tk
-import uuid
+import secrets
 import time
-from collections import deque
 from dataclasses import dataclass
 from tkinter import messagebox, ttk
 from typing import Optional
-from p2p_server import BroadcastPeer, RelayPeer, DiscoveryService, RoomEntry
+from p2p_server import _SLOTS, BroadcastPeer, RelayPeer, DiscoveryService, RoomEntry, is_udp_port_available
 
 AUTO_ROOM_PORT = 4242
 AUTO_ROOM_NAME = "42 Global"
 AUTO_ROOM_CODE = ""
+MAX_TRANSCRIPT_LINES = 2000
+# Chat lines arriving while this many events are already queued are dropped.
+MAX_QUEUED_EVENTS = 10000
+# Housekeeping sleeps until the next deadline, within these bounds; events wake the UI directly.
+HOUSEKEEPING_MIN_MS = 5
+HOUSEKEEPING_MAX_MS = 1000
+# Deadlines in seconds.
+PRESENCE_TIMEOUT = 20
+TYPING_TIMEOUT = 5
+TYPING_IDLE_MS = 3000
+TYPING_RESEND = 1.5
+# Keystrokes within this window are handled as one typing update.
+TYPING_FLUSH_MS = 50
+ROOM_ANNOUNCE_INTERVAL = 8
+# Re-announce interval doubles while a room's membership is unchanged, up to this cap.
+ROOM_ANNOUNCE_MAX = 64
+# Discovery changes are applied to the room list at most this often.
+ROOM_REFRESH_MS = 200
+# A port found unavailable is not probed again for this long.
+PORT_PROBE_RETRY = 2.0
+
+
+@dataclass(**_SLOTS)
+class PeerPresence:
+    name: str
+    last: float
 
 
 @dataclass
@@ -25,16 +51,25 @@ class SessionState:
     room: str
     code: str
     peer: "BroadcastPeer"
-    buffer: list[str]
-    presence: dict[str, dict]
+    # Transcript widget, kept unpacked while another room is shown.
+    text: tk.Text
+    presence: dict[str, PeerPresence]
     typing_states: dict[str, float]
-    outgoing_times: deque
+    # Ring of the last flood_limit_count send times; outgoing_head is the oldest slot.
+    outgoing_times: list[float]
+    outgoing_head: int
     send_penalty_until: float
     last_typing_sent: float
-    last_typing_activity: float
     is_typing: bool
     last_room_announce: float
     connected: bool = False
+    # Bumped when a participant joins, leaves or is renamed.
+    presence_gen: int = 0
+    # Current re-announce interval and the presence_gen seen at the last announce.
+    announce_interval: float = ROOM_ANNOUNCE_INTERVAL
+    announced_gen: int = -1
+    # Pending Tk after() id that clears is_typing once keystrokes stop for TYPING_IDLE_MS.
+    typing_after: Optional[str] = None
 
 
 class MessengerApp:
@@ -47,49 +82,80 @@ class MessengerApp:
         default_name: str = "",
         default_room: str = AUTO_ROOM_NAME,
         default_code: str = AUTO_ROOM_CODE,
+        relay: str = "",
     ):
         self.root = root
         self.root.title("LAN Messenger (P2P)")
-        self.messages = queue.Queue()
-        self.peer_id = uuid.uuid4().hex[:8]
-
-self.relay_host = ""
-self.relay_port = 9000
-if relay:
-    # relay format: host:port
-    if ":" in relay:
-        h, p = relay.rsplit(":", 1)
-        self.relay_host = h.strip()
-        try:
-            self.relay_port = int(p.strip())
-        except ValueError:
-            self.relay_port = 9000
-    else:
-        self.relay_host = relay.strip()
+        self.messages = queue.SimpleQueue()
+        # Producers raise one <<PeerMsg>> per drain; the flag is cleared just before draining.
+        self._wake_lock = threading.Lock()
+        self._wake_pending = False
+        self.root.bind("<<PeerMsg>>", self._drain_queue)
+        self.peer_id = secrets.token_hex(4)
+
+        self.relay_host = ""
+        self.relay_port = 9000
+        if relay:
+            # relay format: host:port
+            if ":" in relay:
+                h, p = relay.rsplit(":", 1)
+                self.relay_host = h.strip()
+                try:
+                    self.relay_port = int(p.strip())
+                except ValueError:
+                    self.relay_port = 9000
+            else:
+                self.relay_host = relay.strip()
         self._create_win: Optional[tk.Toplevel] = None
+        # Port probes bind a socket, so they run on worker threads and report back through _post.
+        self._port_unavailable: dict[int, float] = {}  # port -> time the cached failure expires
+        self._port_waiters: dict[int, list] = {}
 
         self.port_var = tk.StringVar(value=str(default_port))
         self.room_var = tk.StringVar(value=default_room)
         self.code_var = tk.StringVar(value=default_code)
         self.name_var = tk.StringVar(value=default_name)
+        # Our own typing label reads the nickname from here instead of the StringVar.
+        self._my_name = default_name.strip() or "Me"
+        self.name_var.trace_add("write", self._on_name_changed)
         self.msg_var = tk.StringVar()
         self.status_var = tk.StringVar(value="Disconnected")
         self.typing_var = tk.StringVar(value="")
 
-        self.discovery = DiscoveryService(self.peer_id, self._on_rooms_updated)
+        # Set by the discovery callback, cleared just before the debounced refresh re-reads rooms.
+        self._rooms_pending = False
+        self.discovery = DiscoveryService(self.peer_id, self._queue_rooms_update)
         self.discovery.start()
 
-        self.rooms: list[RoomEntry] = []
+        self.rooms: tuple[RoomEntry, ...] = ()
+        # Discovery generation self.rooms was read at; -1 forces the first read.
+        self._rooms_gen = -1
+        # (label, colour) and room identity of each room_list row as last rendered.
+        self._last_room_rows: list[tuple[str, str]] = []
+        # (label, (port, name), identity key) per entry of self.rooms, built once per rooms update.
+        self._room_rows: tuple[tuple[str, tuple[int, str], tuple[str, int, str]], ...] = ()
+        self._last_room_keys: list[tuple[str, int, str]] = []
         self.sessions: dict[tuple[int, str, str], SessionState] = {}
         self.current_session_key: Optional[tuple[int, str, str]] = None
         self.connected_ids: set[tuple[int, str]] = set()
-
+        # One min-heap of (expires_at, kind, session_key, peer_id) for every session's presence
+        # and typing entries; entries renewed since they were pushed are skipped when popped.
+        self._expiry: list[tuple[float, str, tuple[int, str, str], str]] = []
+        # (session key, presence_gen) currently shown in the participants list.
+        self._participants_shown: Optional[tuple[tuple[int, str, str], int]] = None
+        # Inputs of the typing label as last rendered; an unchanged signature skips the rebuild.
+        self._typing_sig: Optional[tuple] = None
+
+        # Session whose typing update is waiting for the coalesced flush, if any.
+        self._typing_flush_key: Optional[tuple[int, str, str]] = None
+        # has_current value the widget states were last set for; None until the first update.
+        self._ui_has_current: Optional[bool] = None
         self._build_ui()
         self._maybe_create_default_room()
         self._on_rooms_updated()
         self.discovery.request_rooms()
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
-        self.root.after(100, self._poll_messages)
+        self.root.after(HOUSEKEEPING_MAX_MS, self._housekeeping)
 
     # ---------------- UI -----------------
     def _build_ui(self) -> None:
@@ -165,13 +231,16 @@ if relay:
         middle_frame = ttk.Frame(right_frame)
         middle_frame.pack(fill="both", expand=True, **padding)
 
-        self.text_area = tk.Text(
-            middle_frame, height=18, state="disabled", wrap="word", bg="#1e1e1e", fg="#e6e6e6"
-        )
-        scrollbar = ttk.Scrollbar(middle_frame, command=self.text_area.yview)
-        self.text_area.configure(yscrollcommand=scrollbar.set)
+        # Each session owns a Text widget; switching rooms swaps which one is packed here.
+        # The blank one is shown while no session is active.
+        self._text_frame = middle_frame
+        self._text_scrollbar = ttk.Scrollbar(middle_frame)
+        self._blank_text = self._new_text_area()
+        self.text_area = self._blank_text
+        self._text_scrollbar.configure(command=self.text_area.yview)
+        self.text_area.configure(yscrollcommand=self._text_scrollbar.set)
         self.text_area.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        self._text_scrollbar.pack(side="right", fill="y")
 
         typing_frame = ttk.Frame(right_frame)
         typing_frame.pack(fill="x", **padding)
@@ -196,28 +265,76 @@ if relay:
         self._update_ui_state()
 
     # -------- Room list & selection ---------
+    def _queue_rooms_update(self) -> None:
+        # Called on the discovery thread; the room list is only touched from the Tk thread.
+        # Changes before the pending refresh runs are picked up by it, so they post nothing.
+        if self._rooms_pending:
+            return
+        self._rooms_pending = True
+        self._post(("rooms",))
+
+    def _apply_rooms_update(self) -> None:
+        self._rooms_pending = False
+        self._on_rooms_updated()
+
     def _on_rooms_updated(self) -> None:
-        self.rooms = sorted(
-            self.discovery.get_rooms(), key=lambda r: (r.port, r.name.lower(), r.creator)
+        # Discovery keeps its rooms sorted incrementally; only take a copy when they changed.
+        gen, rooms = self.discovery.get_rooms_if_changed(self._rooms_gen)
+        if rooms is None:
+            return
+        self._rooms_gen = gen
+        self.rooms = rooms
+        me = self.peer_id
+        self._room_rows = tuple(
+            (
+                f"{room.name} @ {room.port} ({'private' if room.private else 'public'})"
+                + (" [mine]" if room.creator == me else ""),
+                (room.port, room.name),
+                (room.name, room.port, room.creator),
+            )
+            for room in rooms
         )
         self._refresh_room_list()
 
     def _refresh_room_list(self) -> None:
-        self.room_list.delete(0, "end")
+        """Rewrite only the room_list rows whose label or colour changed since the last render."""
         active_id = self.current_session_key[:2] if self.current_session_key else None
-        connected_ids = set(self.connected_ids)
-        for idx, room in enumerate(self.rooms):
-            privacy = "private" if room.private else "public"
-            suffix = " [mine]" if room.creator == self.peer_id else ""
-            label = f"{room.name} @ {room.port} ({privacy}){suffix}"
-            self.room_list.insert("end", label)
-            rid = (room.port, room.name)
+        connected_ids = self.connected_ids
+        rows = []
+        keys = []
+        for label, rid, rkey in self._room_rows:
             if active_id and rid == active_id:
-                self.room_list.itemconfig(idx, fg="#0b3d91")  # active
+                colour = "#0b3d91"  # active
             elif rid in connected_ids:
-                self.room_list.itemconfig(idx, fg="#228b22")  # connected
+                colour = "#228b22"  # connected
             else:
-                self.room_list.itemconfig(idx, fg="black")
+                colour = "black"
+            rows.append((label, colour))
+            keys.append(rkey)
+        old = self._last_room_rows
+        if rows == old and keys == self._last_room_keys:
+            return
+        listbox = self.room_list
+        selected = {self._last_room_keys[idx] for idx in listbox.curselection() if idx < len(self._last_room_keys)}
+        if len(old) > len(rows):
+            listbox.delete(len(rows), "end")
+        for idx, (label, colour) in enumerate(rows):
+            prev = old[idx] if idx < len(old) else None
+            if prev == (label, colour):
+                continue
+            if prev is None or prev[0] != label:
+                if prev is not None:
+                    listbox.delete(idx)
+                listbox.insert(idx, label)
+            listbox.itemconfig(idx, fg=colour)
+        self._last_room_rows = rows
+        self._last_room_keys = keys
+        # Rows may have shifted or been rewritten; reselect the same rooms by identity.
+        if selected:
+            listbox.selection_clear(0, "end")
+            for idx, rkey in enumerate(keys):
+                if rkey in selected:
+                    listbox.selection_set(idx)
 
     def _on_room_select(self, _event=None) -> None:
         selection = self.room_list.curselection()
@@ -252,41 +369,76 @@ if relay:
             self.room_var.set(session.room)
             self.port_label_var.set(str(session.port))
             self.room_label_var.set(session.room)
-            self._load_buffer(session)
+            self._show_text_area(session.text)
             self._refresh_participants_display()
             self._refresh_typing_display(session)
             self.status_var.set(f"UDP {session.port} | room {session.room}")
         self._update_ui_state()
         self._refresh_room_list()
 
-    def _load_buffer(self, session: SessionState) -> None:
-        self.text_area.configure(state="normal")
-        self.text_area.delete("1.0", "end")
-        for line in session.buffer:
-            self.text_area.insert("end", line + "\n")
-        self.text_area.configure(state="disabled")
-        self.text_area.see("end")
+    def _new_text_area(self) -> tk.Text:
+        return tk.Text(
+            self._text_frame, height=18, state="disabled", wrap="word", bg="#1e1e1e", fg="#e6e6e6"
+        )
+
+    def _show_text_area(self, widget: tk.Text) -> None:
+        """Swap the packed transcript; the hidden one keeps its content and layout."""
+        old = self.text_area
+        if widget is old:
+            return
+        # Only the visible widget drives the scrollbar.
+        old.configure(yscrollcommand="")
+        old.pack_forget()
+        widget.configure(yscrollcommand=self._text_scrollbar.set)
+        self._text_scrollbar.configure(command=widget.yview)
+        widget.pack(side="left", fill="both", expand=True, before=self._text_scrollbar)
+        self.text_area = widget
+        widget.see("end")
 
     def _append_to_session(self, key: tuple[int, str, str], message: str) -> None:
+        self._append_lines_to_session(key, [message])
+
+    def _append_lines_to_session(self, key: tuple[int, str, str], lines: list[str]) -> None:
+        """Append several lines to the session's Text with one insert and one state toggle."""
         session = self.sessions.get(key)
         if not session:
             return
-        session.buffer.append(message)
+        text = session.text
+        text.configure(state="normal")
+        text.insert("end", "\n".join(lines) + "\n")
+        # Keep at most MAX_TRANSCRIPT_LINES; the line after the final newline is always empty.
+        excess = int(text.index("end-1c").split(".")[0]) - 1 - MAX_TRANSCRIPT_LINES
+        if excess > 0:
+            text.delete("1.0", f"{excess + 1}.0")
+        text.configure(state="disabled")
         if key == self.current_session_key:
-            self.text_area.configure(state="normal")
-            self.text_area.insert("end", message + "\n")
-            self.text_area.configure(state="disabled")
-            self.text_area.see("end")
+            text.see("end")
 
     # ------------- Networking callbacks -------------
     def _handle_peer_message(self, key: tuple[int, str, str], message: str) -> None:
-        self.messages.put(("msg", key, message))
+        # A flood the Tk thread cannot keep up with must not grow the queue without bound.
+        # Only chat is shed; presence, rooms and probe results are small and must arrive.
+        if self.messages.qsize() >= MAX_QUEUED_EVENTS:
+            return
+        self._post(("msg", key, message))
 
     def _handle_peer_presence(self, key: tuple[int, str, str], peer_id: str, name: str) -> None:
-        self.messages.put(("presence", key, peer_id, name))
+        self._post(("presence", key, peer_id, name))
 
     def _handle_peer_typing(self, key: tuple[int, str, str], peer_id: str, name: str, active: bool) -> None:
-        self.messages.put(("typing", key, peer_id, name, active))
+        self._post(("typing", key, peer_id, name, active))
+
+    def _post(self, evt: tuple) -> None:
+        """Queue an event from any thread and wake the Tk loop to drain it."""
+        self.messages.put(evt)
+        with self._wake_lock:
+            if self._wake_pending:
+                return
+            self._wake_pending = True
+        try:
+            self.root.event_generate("<<PeerMsg>>", when="tail")
+        except (tk.TclError, RuntimeError):
+            pass  # not in mainloop yet, or closing; housekeeping drains the queue anyway
 
     # ------------- Connect / Disconnect -------------
     def _connect(self) -> None:
@@ -308,18 +460,16 @@ if relay:
             self._set_active_session(key)
             return
 
-        
-PeerCls = RelayPeer if self.relay_host else BroadcastPeer
-peer = PeerCls(
-    peer_id=self.peer_id,
-    session_key=key,
-    on_message=self._handle_peer_message,
-    on_presence=self._handle_peer_presence,
-    on_typing=self._handle_peer_typing,
-    **({"relay_host": self.relay_host, "relay_port": self.relay_port} if self.relay_host else {}),
-)
-try:
-
+        PeerCls = RelayPeer if self.relay_host else BroadcastPeer
+        peer = PeerCls(
+            peer_id=self.peer_id,
+            session_key=key,
+            on_message=self._handle_peer_message,
+            on_presence=self._handle_peer_presence,
+            on_typing=self._handle_peer_typing,
+            **({"relay_host": self.relay_host, "relay_port": self.relay_port} if self.relay_host else {}),
+        )
+        try:
             peer.start(name, port, room, code)
         except OSError as exc:
             messagebox.showerror("Could not start", f"Failed to bind port: {exc}")
@@ -331,19 +481,19 @@ try:
             room=room,
             code=code,
             peer=peer,
-            buffer=[],
+            text=self._new_text_area(),
             presence={},
             typing_states={},
-            outgoing_times=deque(),
+            outgoing_times=[float("-inf")] * peer.flood_limit_count,
+            outgoing_head=0,
             send_penalty_until=0.0,
             last_typing_sent=0.0,
-            last_typing_activity=0.0,
             is_typing=False,
             last_room_announce=time.time(),
             connected=True,
         )
-        # seed presence with self
-        session.presence[self.peer_id] = {"name": name, "last": time.time()}
+        # seed presence with self; never queued for expiry, it lasts as long as the session
+        session.presence[self.peer_id] = PeerPresence(name, time.time())
         self.sessions[key] = session
         self.connected_ids.add((port, room))
         self._set_active_session(key)
@@ -357,18 +507,20 @@ try:
             return
         key = self.current_session_key
         session = self.sessions.pop(key, None)
+        self._show_text_area(self._blank_text)
         if session:
+            self._cancel_typing_idle(session)
             session.peer.send_typing(False)
             session.peer.stop(announce=True)
+            session.text.destroy()
         self.connected_ids.discard((key[0], key[1]))
         self.current_session_key = None
         self.status_var.set("Disconnected")
         self._update_ui_state()
         self.participants_list.delete(0, "end")
+        self._participants_shown = None
+        self._typing_sig = None
         self.typing_var.set("")
-        self.text_area.configure(state="normal")
-        self.text_area.delete("1.0", "end")
-        self.text_area.configure(state="disabled")
         self._refresh_room_list()
 
     # ------------- Message sending -------------
@@ -392,45 +544,72 @@ try:
         message = self.msg_var.get().strip()
         if not message:
             return
-        self._prune_outgoing(session, now)
-        if len(session.outgoing_times) >= session.peer.flood_limit_count:
+        if not self._admit_outgoing(session, now):
             session.send_penalty_until = now + session.peer.flood_penalty_seconds
             self._append_to_session(session.key, "Flood control: 10s cooldown applied.")
             return
-        session.outgoing_times.append(now)
         session.peer.send_chat(message)
         session.is_typing = False
+        self._cancel_typing_idle(session)
+        if self._typing_flush_key == session.key:
+            self._typing_flush_key = None  # the pending flush must not re-announce typing
         session.peer.send_typing(False)
         self._append_to_session(session.key, f"Me: {message}")
         self.msg_var.set("")
-        session.last_typing_activity = 0.0
 
-    def _prune_outgoing(self, session: SessionState, now: float) -> None:
-        while session.outgoing_times and now - session.outgoing_times[0] > session.peer.flood_limit_window:
-            session.outgoing_times.popleft()
+    def _admit_outgoing(self, session: SessionState, now: float) -> bool:
+        """Record a send in the ring unless flood_limit_count sends already fall inside the window."""
+        head = session.outgoing_head
+        if now - session.outgoing_times[head] <= session.peer.flood_limit_window:
+            return False
+        session.outgoing_times[head] = now
+        session.outgoing_head = (head + 1) % len(session.outgoing_times)
+        return True
 
     # ------------- Typing UI -------------
     def _typing_event(self, _event=None) -> None:
-        if not self.current_session_key:
+        if not self.current_session_key or self._typing_flush_key is not None:
             return
-        session = self.sessions.get(self.current_session_key)
+        self._typing_flush_key = self.current_session_key
+        self.root.after(TYPING_FLUSH_MS, self._flush_typing)
+
+    def _flush_typing(self) -> None:
+        key, self._typing_flush_key = self._typing_flush_key, None
+        session = self.sessions.get(key)
         if not session:
             return
         session.is_typing = True
-        session.last_typing_activity = time.time()
-        if time.time() - session.last_typing_sent > 1.5:
+        self._cancel_typing_idle(session)
+        session.typing_after = self.root.after(TYPING_IDLE_MS, lambda: self._expire_typing(session))
+        now = time.time()
+        if now - session.last_typing_sent > TYPING_RESEND:
             session.peer.send_typing(True)
-            session.last_typing_sent = time.time()
+            session.last_typing_sent = now
+
+    def _expire_typing(self, session: SessionState) -> None:
+        session.typing_after = None
+        if session.is_typing:
+            session.peer.send_typing(False)
+            session.is_typing = False
+
+    def _cancel_typing_idle(self, session: SessionState) -> None:
+        if session.typing_after is not None:
+            self.root.after_cancel(session.typing_after)
+            session.typing_after = None
+
+    def _on_name_changed(self, *_args) -> None:
+        self._my_name = self.name_var.get().strip() or "Me"
 
     def _refresh_typing_display(self, session: Optional[SessionState] = None) -> None:
         session = session or (self.sessions.get(self.current_session_key) if self.current_session_key else None)
+        # presence_gen covers joins and renames, so the names below cannot change under the same sig.
+        sig = (session.key, tuple(session.typing_states), session.presence_gen, self._my_name) if session else None
+        if sig == self._typing_sig:
+            return
+        self._typing_sig = sig
         if not session:
             self.typing_var.set("")
             return
-        now = time.time()
-        stale = [pid for pid, ts in session.typing_states.items() if now - ts > 5]
-        for pid in stale:
-            session.typing_states.pop(pid, None)
         if not session.typing_states:
             self.typing_var.set("")
             return
@@ -438,9 +617,9 @@ try:
         names = []
         for pid in session.typing_states:
             if pid == self.peer_id:
-                names.append(self.name_var.get().strip() or "Me")
+                names.append(self._my_name)
             elif pid in peers:
-                names.append(peers[pid]["name"])
+                names.append(peers[pid].name)
         names = [n for n in names if n]
         if not names:
             self.typing_var.set("")
@@ -452,76 +631,105 @@ try:
             self.typing_var.set(f"{listed} are typing...")
 
     # ------------- Presence & typing callbacks -------------
-    def _on_presence(self, key: tuple[int, str, str], peer_id: str, name: str) -> None:
+    def _on_presence(self, key: tuple[int, str, str], peer_id: str, name: str, now: float) -> None:
         session = self.sessions.get(key)
         if not session:
             return
-        session.presence[peer_id] = {"name": name, "last": time.time()}
+        data = session.presence.get(peer_id)
+        if data is None or data.name != name:
+            session.presence_gen += 1
+        if data is None:
+            session.announce_interval = ROOM_ANNOUNCE_INTERVAL  # a newcomer; advertise at full rate again
+            session.presence[peer_id] = PeerPresence(name, now)
+        else:
+            data.name = name
+            data.last = now
+        heapq.heappush(self._expiry, (now + PRESENCE_TIMEOUT, "presence", key, peer_id))
         if key == self.current_session_key:
             self._refresh_participants_display()
 
-    def _on_typing(self, key: tuple[int, str, str], peer_id: str, name: str, active: bool) -> None:
+    def _on_typing(self, key: tuple[int, str, str], peer_id: str, name: str, active: bool, now: float) -> None:
         session = self.sessions.get(key)
         if not session:
             return
         if active:
-            session.typing_states[peer_id] = time.time()
+            session.typing_states[peer_id] = now
+            heapq.heappush(self._expiry, (now + TYPING_TIMEOUT, "typing", key, peer_id))
         else:
             session.typing_states.pop(peer_id, None)
         if key == self.current_session_key:
             self._refresh_typing_display(session)
 
     def _refresh_participants_display(self) -> None:
-        self.participants_list.delete(0, "end")
-        if not self.current_session_key:
-            return
-        session = self.sessions.get(self.current_session_key)
+        session = self.sessions.get(self.current_session_key) if self.current_session_key else None
         if not session:
+            self.participants_list.delete(0, "end")
+            self._participants_shown = None
             return
-        now = time.time()
-        stale = [pid for pid, data in session.presence.items() if now - data.get("last", 0) > 20]
-        for pid in stale:
-            session.presence.pop(pid, None)
+        shown = (session.key, session.presence_gen)
+        if shown == self._participants_shown:
+            return  # same members as the last render
+        self._participants_shown = shown
+        self.participants_list.delete(0, "end")
         peers = session.presence
-        items = sorted(peers.items(), key=lambda item: (item[1]["name"].lower(), item[0]))
+        items = sorted(peers.items(), key=lambda item: (item[1].name.lower(), item[0]))
         for _, data in items:
-            self.participants_list.insert("end", data["name"])
+            self.participants_list.insert("end", data.name)
 
-    # ------------- Poll loop -------------
-    def _poll_messages(self) -> None:
+    # ------------- Event drain & housekeeping -------------
+    def _drain_queue(self, _event=None) -> None:
+        with self._wake_lock:
+            self._wake_pending = False
+        events = []
         while True:
             try:
-                evt = self.messages.get_nowait()
+                events.append(self.messages.get_nowait())
             except queue.Empty:
                 break
+        # Chat lines are grouped per session so each gets a single Text insert.
+        batches: dict[tuple[int, str, str], list[str]] = {}
+        for evt in events:
+            if evt[0] == "msg":
+                batches.setdefault(evt[1], []).append(evt[2])
+        for key, lines in batches.items():
+            # Older lines beyond the transcript cap would be trimmed right after insertion.
+            self._append_lines_to_session(key, lines[-MAX_TRANSCRIPT_LINES:])
+        now = time.time()  # one clock read stamps the whole batch
+        for evt in events:
             kind = evt[0]
-            if kind == "msg":
-                _, key, msg = evt
-                self._append_to_session(key, msg)
-            elif kind == "presence":
+            if kind == "presence":
                 _, key, pid, name = evt
-                self._on_presence(key, pid, name)
+                self._on_presence(key, pid, name, now)
             elif kind == "typing":
                 _, key, pid, name, active = evt
-                self._on_typing(key, pid, name, active)
-        # house-keeping
-        self._cleanup_presence_typing()
+                self._on_typing(key, pid, name, active, now)
+            elif kind == "rooms":
+                self.root.after(ROOM_REFRESH_MS, self._apply_rooms_update)
+            elif kind == "port":
+                _, port, ok = evt
+                self._on_port_probed(port, ok)
+
+    def _housekeeping(self) -> None:
+        # Also picks up anything queued while a wakeup could not be delivered.
+        self._drain_queue()
+        # next_due tracks the earliest deadline so the next run can sleep until it
         now = time.time()
-        if self.current_session_key:
-            session = self.sessions.get(self.current_session_key)
-            if session:
-                if session.is_typing and now - session.last_typing_activity > 3:
-                    session.peer.send_typing(False)
-                    session.is_typing = False
-                self._refresh_typing_display(session)
+        next_due = self._cleanup_presence_typing(now)
         # re-announce connected rooms periodically
         for session in list(self.sessions.values()):
             if not session.connected:
                 continue
-            if now - session.last_room_announce > 8:
+            if now - session.last_room_announce > session.announce_interval:
                 self._broadcast_room_advertisement(session)
                 session.last_room_announce = now
-        self.root.after(100, self._poll_messages)
+                if session.presence_gen == session.announced_gen:
+                    session.announce_interval = min(session.announce_interval * 2, ROOM_ANNOUNCE_MAX)
+                else:
+                    session.announce_interval = ROOM_ANNOUNCE_INTERVAL
+                    session.announced_gen = session.presence_gen
+            next_due = min(next_due, session.last_room_announce + session.announce_interval)
+        delay = max(HOUSEKEEPING_MIN_MS, min(HOUSEKEEPING_MAX_MS, int((next_due - now) * 1000) + 1))
+        self.root.after(delay, self._housekeeping)
 
     # ------------- Room advertisement -------------
     def _broadcast_room_advertisement(self, session: SessionState) -> None:
@@ -533,22 +741,35 @@ try:
         )
         self.discovery.announce_room(room_entry)
 
-    def _port_is_available(self, port: int) -> bool:
-        test_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            test_sock.bind(("", port))
-            return True
-        except OSError:
-            return False
-        finally:
-            try:
-                test_sock.close()
-            except OSError:
-                pass
+    def _probe_port(self, port: int, callback) -> None:
+        """Check off the Tk thread whether port can be bound; callback(ok) runs on the Tk thread."""
+        expires = self._port_unavailable.get(port)
+        if expires is not None:
+            if time.time() < expires:
+                callback(False)
+                return
+            del self._port_unavailable[port]
+        waiters = self._port_waiters.get(port)
+        if waiters is not None:
+            waiters.append(callback)  # a probe for this port is already running
+            return
+        self._port_waiters[port] = [callback]
+        threading.Thread(
+            target=lambda: self._post(("port", port, is_udp_port_available(port))), daemon=True
+        ).start()
+
+    def _on_port_probed(self, port: int, ok: bool) -> None:
+        if not ok:
+            self._port_unavailable[port] = time.time() + PORT_PROBE_RETRY
+        for callback in self._port_waiters.pop(port, ()):
+            callback(ok)
 
     def _maybe_create_default_room(self) -> None:
-        """Create and announce the default room if the port is free."""
-        if not self._port_is_available(AUTO_ROOM_PORT):
+        """Create and announce the default room once a probe finds the port free."""
+        self._probe_port(AUTO_ROOM_PORT, self._create_default_room)
+
+    def _create_default_room(self, ok: bool) -> None:
+        if not ok:
             print(f"[auto-room] Port {AUTO_ROOM_PORT} unavailable; default room not created.")
             return
         room = RoomEntry(
@@ -560,57 +781,66 @@ try:
             local=True,
         )
         self.discovery.add_local_room(room)
+        self._on_rooms_updated()
 
     # ------------- Create/Delete room -------------
-    def _open_create_room_window(self) -> None:
-        if hasattr(self, "_create_win") and self._create_win is not None:
-            self._create_win.lift()
-            return
+    def _build_create_room_window(self) -> tk.Toplevel:
+        """Build the Create Room window once; closing it only withdraws it."""
         win = tk.Toplevel(self.root)
         win.title("Create Room")
-        self._create_win = win
+        win.withdraw()
 
         padding = {"padx": 10, "pady": 6}
         ttk.Label(win, text="Port").grid(row=0, column=0, sticky="w", **padding)
-        port_entry = ttk.Entry(win)
-        port_entry.insert(0, self.port_var.get())
-        port_entry.grid(row=0, column=1, sticky="we", **padding)
+        self._create_port_entry = ttk.Entry(win)
+        self._create_port_entry.grid(row=0, column=1, sticky="we", **padding)
 
         ttk.Label(win, text="Room name").grid(row=1, column=0, sticky="w", **padding)
-        room_entry = ttk.Entry(win)
-        room_entry.insert(0, self.room_var.get())
-        room_entry.grid(row=1, column=1, sticky="we", **padding)
+        self._create_room_entry = ttk.Entry(win)
+        self._create_room_entry.grid(row=1, column=1, sticky="we", **padding)
 
         ttk.Label(win, text="Code (optional)").grid(row=2, column=0, sticky="w", **padding)
-        code_entry = ttk.Entry(win)
-        code_entry.insert(0, self.code_var.get())
-        code_entry.grid(row=2, column=1, sticky="we", **padding)
-
-        create_btn = ttk.Button(
-            win,
-            text="Create the Room",
-            command=lambda: self._create_room(win, port_entry, room_entry, code_entry),
-        )
+        self._create_code_entry = ttk.Entry(win)
+        self._create_code_entry.grid(row=2, column=1, sticky="we", **padding)
+
+        create_btn = ttk.Button(win, text="Create the Room", command=self._create_room)
         create_btn.grid(row=3, column=0, columnspan=2, sticky="we", padx=10, pady=(4, 10))
 
         win.columnconfigure(1, weight=1)
+        win.protocol("WM_DELETE_WINDOW", win.withdraw)
+        return win
 
-        def on_close() -> None:
-            self._create_win = None
-            win.destroy()
-
-        win.protocol("WM_DELETE_WINDOW", on_close)
-
-    def _create_room(self, win: tk.Toplevel, port_entry: ttk.Entry, room_entry: ttk.Entry, code_entry: ttk.Entry) -> None:
-        room_name = room_entry.get().strip() or "public"
-        code = code_entry.get().strip()
+    def _open_create_room_window(self) -> None:
+        if self._create_win is None:
+            self._create_win = self._build_create_room_window()
+        win = self._create_win
+        if win.state() != "withdrawn":
+            win.lift()
+            return
+        for entry, value in (
+            (self._create_port_entry, self.port_var.get()),
+            (self._create_room_entry, self.room_var.get()),
+            (self._create_code_entry, self.code_var.get()),
+        ):
+            entry.delete(0, "end")
+            entry.insert(0, value)
+        win.deiconify()
+        win.lift()
+
+    def _create_room(self) -> None:
+        room_name = self._create_room_entry.get().strip() or "public"
+        code = self._create_code_entry.get().strip()
         try:
-            port = int(port_entry.get().strip())
+            port = int(self._create_port_entry.get().strip())
         except ValueError:
             messagebox.showerror("Invalid port", "Port must be a number.")
             return
 
-        if not self._port_is_available(port):
+        # The window stays open until the probe reports back.
+        self._probe_port(port, lambda ok: self._finish_create_room(ok, port, room_name, code))
+
+    def _finish_create_room(self, ok: bool, port: int, room_name: str, code: str) -> None:
+        if not ok:
             messagebox.showerror("Port unavailable", f"Port {port} cannot be bound on this host.")
             return
 
@@ -629,8 +859,7 @@ try:
         self.port_label_var.set(str(port))
         self.room_label_var.set(room_name)
         self.code_var.set(code)
-        self._create_win = None
-        win.destroy()
+        self._create_win.withdraw()
 
     def _delete_room(self) -> None:
         selection = self.room_list.curselection()
@@ -648,24 +877,38 @@ try:
         self._on_rooms_updated()
 
     # ------------- Cleanup / UI state -------------
-    def _cleanup_presence_typing(self) -> None:
-        now = time.time()
-        for session in self.sessions.values():
-            stale = [pid for pid, data in session.presence.items() if now - data.get("last", 0) > 20]
-            for pid in stale:
-                session.presence.pop(pid, None)
-            stale_typing = [pid for pid, ts in session.typing_states.items() if now - ts > 5]
-            for pid in stale_typing:
-                session.typing_states.pop(pid, None)
+    def _cleanup_presence_typing(self, now: float) -> float:
+        """Drop stale presence/typing entries and return when the next surviving one expires."""
+        heap = self._expiry
+        while heap and heap[0][0] < now:
+            _, kind, key, pid = heapq.heappop(heap)
+            session = self.sessions.get(key)
+            if session is None:
+                continue  # disconnected since the entry was pushed
+            if kind == "presence":
+                data = session.presence.get(pid)
+                if data is not None and now - data.last > PRESENCE_TIMEOUT:
+                    del session.presence[pid]
+                    session.presence_gen += 1
+            else:
+                ts = session.typing_states.get(pid)
+                if ts is not None and now - ts > TYPING_TIMEOUT:
+                    del session.typing_states[pid]
         if self.current_session_key:
             self._refresh_participants_display()
             self._refresh_typing_display()
+        return heap[0][0] if heap else float("inf")
 
     def _update_ui_state(self) -> None:
         has_current = self.current_session_key in self.sessions if self.current_session_key else False
-        self.code_entry.configure(state="normal")
-        self.name_entry.configure(state="normal")
-        self.connect_button.configure(state="normal")
+        if has_current == self._ui_has_current:
+            return  # every widget already has the right state
+        if self._ui_has_current is None:
+            # These never change; set them on the first call only.
+            self.code_entry.configure(state="normal")
+            self.name_entry.configure(state="normal")
+            self.connect_button.configure(state="normal")
+        self._ui_has_current = has_current
         self.disconnect_button.configure(state="normal" if has_current else "disabled")
         self.send_button.configure(state="normal" if has_current else "disabled")
         self.message_entry.configure(state="normal" if has_current else "disabled")
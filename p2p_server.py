@@ -3,18 +3,461 @@
 
 from __future__ import annotations
 
-import base64
+import ctypes
+import ctypes.util
+import errno
 import json
+import os
+import selectors
 import socket
 import struct
+import sys
 import threading
 import time
-from collections import deque
+from bisect import bisect_left
 from dataclasses import dataclass
 from typing import Optional
 
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json produces the same compact bytes
+    orjson = None
+
+try:
+    from sortedcontainers import SortedKeyList
+except ImportError:  # optional; _SortedRooms below is the bisect-based fallback
+    SortedKeyList = None
+
+try:
+    import psutil
+except ImportError:  # optional; without it discovery relies on the limited broadcast + multicast
+    psutil = None
+
+RECV_BUFSIZE = 4096
+RECV_BATCH = 32
+# Requested kernel buffer sizes; Linux caps them at net.core.rmem_max / wmem_max.
+SOCK_RCVBUF = 4 * 1024 * 1024
+SOCK_SNDBUF = 1 * 1024 * 1024
+SEND_BUFSIZE = 4096
+# Relay frames: 4-byte big-endian length, then at most MAX_FRAME payload bytes.
+_FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME = 1024 * 1024
+# Relay socket timeout; peers send presence every 5 s, so a healthy stream never idles this long.
+RELAY_TIMEOUT = 30.0
+# Soft cap on DiscoveryService's room table; the least recently changed remote room goes first.
+MAX_ROOMS = 1024
+# Encoded room_announce datagrams kept by DiscoveryService before the cache is reset.
+ANNOUNCE_CACHE_MAX = 256
+# Numeric limited-broadcast address; "<broadcast>" is re-parsed by CPython on every sendto.
+BROADCAST_ADDR = "255.255.255.255"
+
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads
+
+
+def _try_dumps(obj) -> Optional[bytes]:
+    """_dumps, or None if obj can't be encoded (e.g. text carrying a lone surrogate)."""
+    try:
+        return _dumps(obj)
+    except (TypeError, ValueError):  # orjson's error is a TypeError; stdlib's UnicodeEncodeError a ValueError
+        return None
+
+
+def _tune_buffers(sock: socket.socket) -> None:
+    """Enlarge socket buffers so bursts queue in the kernel instead of being dropped."""
+    for opt, size in ((socket.SO_RCVBUF, SOCK_RCVBUF), (socket.SO_SNDBUF, SOCK_SNDBUF)):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, size)
+        except OSError:
+            pass
+
+
+def is_udp_port_available(port: int) -> bool:
+    """Return True if a chat socket could bind port, using the same reuse options as the peers."""
+    if PortMultiplexer.holds(port):
+        return True
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except (OSError, AttributeError):
+                pass
+            sock.bind(("", port))
+    except (OSError, OverflowError):
+        return False
+    return True
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    # Linux layout of struct sockaddr_in; sin_port and sin_addr are in network byte order.
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def _load_mmsg(name: str, argtypes: list):
+    """Return libc's recvmmsg(2)/sendmmsg(2), or None where it is unavailable (Windows/macOS)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fn = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = argtypes
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_recvmmsg = _load_mmsg(
+    "recvmmsg", [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+)
+_sendmmsg = _load_mmsg("sendmmsg", [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int])
+
+
+def _send_batch(sock: socket.socket, packets: list[tuple[bytes, tuple[str, int]]]) -> None:
+    """Send every (data, addr) packet, in one sendmmsg(2) call where available."""
+    if _sendmmsg is None or len(packets) < 2:
+        _sendto_each(sock, packets)
+        return
+    fd = sock.fileno()
+    if fd < 0:
+        raise OSError(errno.EBADF, "socket closed")
+    count = len(packets)
+    dests: dict[tuple[str, int], _SockAddrIn] = {}
+    iovs = (_IOVec * count)()
+    msgs = (_MMsgHdr * count)()
+    for i, (data, addr) in enumerate(packets):
+        dest = dests.get(addr)
+        if dest is None:
+            dest = dests[addr] = _SockAddrIn(socket.AF_INET, socket.htons(addr[1]))
+            dest.sin_addr[:] = socket.inet_aton(addr[0])
+        # packets keeps each bytes object alive for the duration of the call.
+        iovs[i].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+        iovs[i].iov_len = len(data)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_name = ctypes.addressof(dest)
+        hdr.msg_namelen = ctypes.sizeof(dest)
+        hdr.msg_iov = ctypes.pointer(iovs[i])
+        hdr.msg_iovlen = 1
+    sent = _sendmmsg(fd, msgs, count, 0)
+    if sent < 0:
+        # The first packet failed; the others may still be deliverable.
+        _sendto_each(sock, packets)
+        return
+    if sent < count:
+        try:
+            _sendto_each(sock, packets[sent:])
+        except OSError:
+            pass  # part of the batch already went out
+
+
+def _sendto_each(sock: socket.socket, packets: list[tuple[bytes, tuple[str, int]]]) -> None:
+    """sendto every packet; one unreachable destination doesn't stop the rest.
+
+    Raises the last error only if no packet could be sent at all.
+    """
+    error: Optional[OSError] = None
+    sent_any = False
+    for data, addr in packets:
+        try:
+            sock.sendto(data, addr)
+            sent_any = True
+        except OSError as exc:
+            error = exc
+    if error is not None and not sent_any:
+        raise error
+
+
+def _local_ipv4() -> Optional[str]:
+    """Best-effort primary IPv4 address; connecting a UDP socket sends nothing."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(("10.255.255.255", 1))
+            ip = sock.getsockname()[0]
+    except OSError:
+        return None
+    return None if ip.startswith("127.") or ip == "0.0.0.0" else ip
+
+
+def _interface_broadcasts() -> list[str]:
+    """Directed broadcast address of every up, non-loopback IPv4 interface (needs psutil)."""
+    if psutil is None:
+        return []
+    try:
+        stats = psutil.net_if_stats()
+        addrs = psutil.net_if_addrs()
+    except Exception:
+        return []
+    found: list[str] = []
+    for nic, entries in addrs.items():
+        st = stats.get(nic)
+        if st is not None and not st.isup:
+            continue
+        for addr in entries:
+            if addr.family != socket.AF_INET or not addr.broadcast or addr.address.startswith("127."):
+                continue
+            if addr.broadcast not in found:
+                found.append(addr.broadcast)
+    return found
+
+
+class _RecvBatch:
+    """Receives up to RECV_BATCH datagrams per syscall, falling back to recvfrom."""
+
+    def __init__(self, size: int = RECV_BATCH, bufsize: int = RECV_BUFSIZE) -> None:
+        self.bufsize = bufsize
+        self.bufs = [bytearray(bufsize) for _ in range(size)]
+        # Slicing a view copies nothing, so each datagram costs one right-sized bytes copy.
+        self.views = [memoryview(buf) for buf in self.bufs]
+        self.msgs = None
+        if _recvmmsg is None:
+            return
+        self.iovs = (_IOVec * size)()
+        self.msgs = (_MMsgHdr * size)()
+        for i, buf in enumerate(self.bufs):
+            self.iovs[i].iov_base = ctypes.addressof(ctypes.c_char.from_buffer(buf))
+            self.iovs[i].iov_len = bufsize
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def recv(self, sock: socket.socket) -> list[bytes]:
+        """Return up to RECV_BATCH datagrams already queued on a non-blocking socket."""
+        if self.msgs is None:
+            # Reuse one buffer so each datagram costs a single right-sized copy.
+            buf = self.bufs[0]
+            view = self.views[0]
+            datagrams = []
+            for _ in range(len(self.bufs)):
+                try:
+                    n, _addr = sock.recvfrom_into(buf)
+                except BlockingIOError:
+                    break
+                datagrams.append(bytes(view[:n]))
+            return datagrams
+        fd = sock.fileno()
+        if fd < 0:
+            raise OSError(errno.EBADF, "socket closed")
+        n = _recvmmsg(fd, self.msgs, len(self.bufs), socket.MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+        return [bytes(self.views[i][: self.msgs[i].msg_len]) for i in range(n)]
+
+    def drain(self, sock: socket.socket, handle) -> None:
+        """Feed every queued datagram to handle(data) until the socket would block."""
+        while True:
+            datagrams = self.recv(sock)
+            for data in datagrams:
+                handle(data)
+            if len(datagrams) < len(self.bufs):
+                return
+
+
+class NetworkReactor:
+    """One selector thread that services every UDP socket in the process."""
+
+    _shared: Optional["NetworkReactor"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        # The loop blocks in select() with no timeout; a byte on this pair wakes it
+        # to notice registrations changing (and to exit once nothing is left).
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, self._drain_wake)
+
+    @classmethod
+    def shared(cls) -> "NetworkReactor":
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def register(self, sock: socket.socket, on_ready) -> None:
+        """Call on_ready() from the reactor thread whenever sock is readable."""
+        with self.lock:
+            self.selector.register(sock, selectors.EVENT_READ, on_ready)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        # A select() already in progress may not watch the new socket (SelectSelector).
+        self._wake()
+
+    def unregister(self, sock: socket.socket) -> None:
+        with self.lock:
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                return
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass  # buffer full: a wakeup is already pending
+
+    def _drain_wake(self) -> None:
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            with self.lock:
+                if len(self.selector.get_map()) <= 1:  # only the wake socket is left
+                    self.thread = None
+                    return
+            try:
+                events = self.selector.select()
+            except OSError:
+                continue
+            for key, _mask in events:
+                try:
+                    key.data()
+                except Exception:
+                    pass
+
+
+class PortMultiplexer:
+    """One bound UDP socket per chat port, shared by every BroadcastPeer on that port.
+
+    Datagrams are routed to handlers by the encoded room/code tags, so peers in
+    other rooms on the same port never see them.
+    """
+
+    _by_port: dict[int, "PortMultiplexer"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, port: int) -> None:
+        self.port = port
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except (OSError, AttributeError):
+            pass
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        try:
+            sock.bind(("", port))
+        except OSError:
+            try:
+                sock.close()
+            except OSError:
+                pass
+            raise
+        _tune_buffers(sock)
+        sock.setblocking(False)
+        self.sock = sock
+        # Replaced, never mutated, so the reactor thread can iterate it without locking.
+        self.routes: dict[tuple[bytes, bytes], list] = {}
+        self._rx_batch = _RecvBatch()
+        self.reactor = NetworkReactor.shared()
+        self.reactor.register(sock, self._on_ready)
+
+    @classmethod
+    def attach(cls, port: int, route: tuple[bytes, bytes], handler) -> "PortMultiplexer":
+        """Route datagrams containing both tags in route to handler(data), binding port if needed."""
+        with cls._registry_lock:
+            mux = cls._by_port.get(port)
+            if mux is None:
+                mux = cls._by_port[port] = cls(port)
+            routes = dict(mux.routes)
+            routes[route] = routes.get(route, []) + [handler]
+            mux.routes = routes
+            return mux
+
+    @classmethod
+    def holds(cls, port: int) -> bool:
+        """True if this process already has a socket bound to port."""
+        with cls._registry_lock:
+            return port in cls._by_port
+
+    def detach(self, route: tuple[bytes, bytes], handler) -> None:
+        """Remove handler; the socket is closed once no handlers remain."""
+        with self._registry_lock:
+            routes = dict(self.routes)
+            handlers = [h for h in routes.get(route, []) if h != handler]
+            if handlers:
+                routes[route] = handlers
+            else:
+                routes.pop(route, None)
+            self.routes = routes
+            if not routes:
+                self._close()
+
+    def _close(self) -> None:
+        # Caller holds _registry_lock.
+        if self._by_port.get(self.port) is self:
+            del self._by_port[self.port]
+        self.routes = {}
+        self.reactor.unregister(self.sock)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _on_ready(self) -> None:
+        try:
+            self._rx_batch.drain(self.sock, self._dispatch)
+        except OSError:
+            with self._registry_lock:
+                self._close()
+
+    def _dispatch(self, data: bytes) -> None:
+        # Senders emit compact JSON, so foreign rooms can be rejected before parsing.
+        for (room_tag, code_tag), handlers in self.routes.items():
+            if room_tag in data and code_tag in data:
+                for handler in handlers:
+                    handler(data)
+
+
+# Slotted dataclasses need Python 3.10; older interpreters get the plain layout.
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 
-@dataclass
+@dataclass(**_SLOTS)
 class RoomEntry:
     name: str
     port: int
@@ -24,20 +467,79 @@ class RoomEntry:
     local: bool = False
 
 
+def _room_order(room: RoomEntry) -> tuple:
+    return (room.port, room.name.lower(), room.creator)
+
+
+class _SortedRooms:
+    """Minimal stand-in for SortedKeyList: a list kept in _room_order via bisect."""
+
+    def __init__(self) -> None:
+        self._keys: list[tuple] = []
+        self._items: list[RoomEntry] = []
+
+    def add(self, room: RoomEntry) -> None:
+        order = _room_order(room)
+        i = bisect_left(self._keys, order)
+        self._keys.insert(i, order)
+        self._items.insert(i, room)
+
+    def remove(self, room: RoomEntry) -> None:
+        order = _room_order(room)
+        i = bisect_left(self._keys, order)
+        while i < len(self._items) and self._keys[i] == order:
+            if self._items[i] is room:
+                del self._keys[i]
+                del self._items[i]
+                return
+            i += 1
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
 class DiscoveryService:
-    """Handles room discovery announcements over a fixed UDP broadcast port."""
+    """Handles room discovery announcements over a fixed UDP port.
+
+    Every message is sent both to the limited broadcast address and to a
+    link-local multicast group, since managed Wi-Fi often filters one of them.
+    Own rooms are additionally unicast to every host of the local /24 every
+    SUBNET_SWEEP_SECONDS for networks that drop both. Duplicates collapse in
+    the rooms dict, which is keyed by room identity.
+    """
 
     DISCOVERY_PORT = 54545
+    MULTICAST_GROUP = "224.0.0.200"
+    SUBNET_SWEEP_SECONDS = 30.0
+    # A room_request arrives once per destination it was sent to; answer each sender once per window.
+    REQUEST_DEDUP_SECONDS = 2.0
 
     def __init__(self, peer_id: str, on_rooms_changed) -> None:
         self.peer_id = peer_id
         self.on_rooms_changed = on_rooms_changed
         self.sock: Optional[socket.socket] = None
         self.running = False
-        self.thread: Optional[threading.Thread] = None
+        self.reactor = NetworkReactor.shared()
+        self._rx_batch = _RecvBatch()
         self.lock = threading.Lock()
-        self.rooms: dict[str, RoomEntry] = {}
-        self.local_rooms: dict[str, RoomEntry] = {}
+        # room_announce datagrams keyed by (name, port, private, creator).
+        self._announce_cache: dict[tuple, bytes] = {}
+        self.rooms: dict[tuple[str, int], RoomEntry] = {}
+        self.local_rooms: dict[tuple[str, int], RoomEntry] = {}
+        # Same entries as self.rooms, kept in display order so get_rooms never re-sorts.
+        self._ordered = SortedKeyList(key=_room_order) if SortedKeyList is not None else _SortedRooms()
+        # Bumped on every change to self.rooms so readers can skip unchanged snapshots.
+        self._rooms_gen = 0
+        # (generation, ordered rooms) published as one immutable pair; see _snapshot_rooms.
+        self._snapshot: tuple[int, tuple[RoomEntry, ...]] = (0, ())
+        self._bcast_addr = (BROADCAST_ADDR, self.DISCOVERY_PORT)
+        self._dests = [self._bcast_addr]
+        self._last_sweep = 0.0
+        # Requester id -> when we last answered it; only touched on the reactor thread.
+        self._answered: dict[str, float] = {}
 
     def start(self) -> None:
         if self.running:
@@ -57,15 +559,29 @@ class DiscoveryService:
         except OSError:
             sock.close()
             return
-        sock.settimeout(1.0)
+        _tune_buffers(sock)
+        # 255.255.255.255 only leaves through the default-route interface; on multi-homed
+        # hosts the per-interface directed broadcasts reach the other networks too.
+        self._dests = [self._bcast_addr] + [(addr, self.DISCOVERY_PORT) for addr in _interface_broadcasts()]
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(
+                socket.IPPROTO_IP,
+                socket.IP_ADD_MEMBERSHIP,
+                socket.inet_aton(self.MULTICAST_GROUP) + socket.inet_aton("0.0.0.0"),
+            )
+            self._dests.append((self.MULTICAST_GROUP, self.DISCOVERY_PORT))
+        except OSError:
+            pass  # no multicast-capable interface; broadcast still works
+        sock.setblocking(False)
         self.sock = sock
         self.running = True
-        self.thread = threading.Thread(target=self._recv_loop, daemon=True)
-        self.thread.start()
+        self.reactor.register(sock, self._on_discovery_ready)
 
     def stop(self) -> None:
         self.running = False
         if self.sock is not None:
+            self.reactor.unregister(self.sock)
             try:
                 self.sock.close()
             except OSError:
@@ -73,23 +589,45 @@ class DiscoveryService:
             self.sock = None
 
     def get_rooms(self) -> list[RoomEntry]:
-        with self.lock:
-            return list(self.rooms.values())
+        """Return known rooms ordered by (port, name, creator)."""
+        return list(self._snapshot_rooms()[1])
+
+    def get_rooms_if_changed(self, last_gen: int) -> tuple[int, Optional[tuple[RoomEntry, ...]]]:
+        """Return (generation, rooms); rooms is None if nothing changed since last_gen."""
+        gen, rooms = self._snapshot_rooms()
+        if gen == last_gen:
+            return gen, None
+        return gen, rooms
+
+    def _snapshot_rooms(self) -> tuple[int, tuple[RoomEntry, ...]]:
+        # Readers take the lock only when the published snapshot is behind the table;
+        # rebinding the attribute is atomic, so the lock-free path sees a consistent pair.
+        snap = self._snapshot
+        if snap[0] != self._rooms_gen:
+            with self.lock:
+                snap = self._snapshot
+                if snap[0] != self._rooms_gen:
+                    snap = (self._rooms_gen, tuple(self._ordered))
+                    self._snapshot = snap
+        return snap
 
     def add_local_room(self, room: RoomEntry) -> None:
         key = self._room_key(room)
         room.local = True
         with self.lock:
+            existing = self.local_rooms.get(key)
+            changed = not (existing and self._same_room(existing, room) and existing.code == room.code)
             self.local_rooms[key] = room
-            self.rooms[key] = room
+            self._put_room(key, room)
         self._announce(room)
-        self._notify()
+        if changed:
+            self._notify()
 
     def remove_room(self, room: RoomEntry) -> None:
         key = self._room_key(room)
         with self.lock:
             self.local_rooms.pop(key, None)
-            removed = self.rooms.pop(key, None)
+            removed = self._pop_room(key)
         if removed:
             self._broadcast(
                 {
@@ -105,64 +643,131 @@ class DiscoveryService:
     def announce_room(self, room: RoomEntry) -> None:
         key = self._room_key(room)
         with self.lock:
-            self.rooms[key] = room
+            existing = self.rooms.get(key)
+            changed = not (existing and self._same_room(existing, room))
+            if changed:
+                self._put_room(key, room)
         self._announce(room)
-        self._notify()
+        if changed:
+            self._notify()
+
+    def announce_rooms(self, rooms: list[RoomEntry]) -> None:
+        """Announce several rooms at once; the datagrams go out in a single batched send."""
+        changed = False
+        with self.lock:
+            for room in rooms:
+                key = self._room_key(room)
+                existing = self.rooms.get(key)
+                if not (existing and self._same_room(existing, room)):
+                    self._put_room(key, room)
+                    changed = True
+        if self.sock is not None:
+            try:
+                datagrams = [data for data in map(self._announce_bytes, rooms) if data is not None]
+                dests = self._dests
+                now = time.monotonic()
+                if now - self._last_sweep >= self.SUBNET_SWEEP_SECONDS:
+                    self._last_sweep = now
+                    dests = dests + self._subnet_dests()
+                _send_batch(self.sock, [(data, dest) for dest in dests for data in datagrams])
+            except OSError:
+                pass
+        if changed:
+            self._notify()
 
     def request_rooms(self) -> None:
         self._broadcast({"type": "room_request", "from": self.peer_id})
 
     def _announce(self, room: RoomEntry) -> None:
-        self._broadcast(
-            {
-                "type": "room_announce",
-                "name": room.name,
-                "port": room.port,
-                "private": room.private,
-                "creator": room.creator,
-            }
-        )
+        data = self._announce_bytes(room)
+        if data is not None:
+            self._broadcast_data(data)
+
+    def _announce_bytes(self, room: RoomEntry) -> Optional[bytes]:
+        """Encoded room_announce for room, or None if it can't be encoded; re-announces reuse the cache."""
+        sig = (room.name, room.port, room.private, room.creator)
+        data = self._announce_cache.get(sig)
+        if data is None:
+            data = _try_dumps(self._announce_payload(room))
+            if data is None:
+                return None
+            if len(self._announce_cache) >= ANNOUNCE_CACHE_MAX:
+                self._announce_cache.clear()
+            self._announce_cache[sig] = data
+        return data
+
+    @staticmethod
+    def _announce_payload(room: RoomEntry) -> dict:
+        return {
+            "type": "room_announce",
+            "name": room.name,
+            "port": room.port,
+            "private": room.private,
+            "creator": room.creator,
+        }
 
     def _broadcast(self, payload: dict) -> None:
+        data = _try_dumps(payload)
+        if data is not None:
+            self._broadcast_data(data)
+
+    def _broadcast_data(self, data: bytes) -> None:
         if self.sock is None:
             return
         try:
-            data = json.dumps(payload).encode("utf-8")
-            self.sock.sendto(data, ("<broadcast>", self.DISCOVERY_PORT))
+            _send_batch(self.sock, [(data, dest) for dest in self._dests])
         except OSError:
             pass
 
+    def _subnet_dests(self) -> list[tuple[str, int]]:
+        ip = _local_ipv4()
+        if ip is None:
+            return []
+        prefix = ip.rsplit(".", 1)[0]
+        return [(f"{prefix}.{host}", self.DISCOVERY_PORT) for host in range(1, 255)]
+
     def _decode(self, data: bytes) -> Optional[dict]:
         try:
-            return json.loads(data.decode("utf-8"))
-        except (json.JSONDecodeError, UnicodeDecodeError):
+            payload = _loads(data)
+        except ValueError:
             return None
+        return payload if isinstance(payload, dict) else None
 
-    def _recv_loop(self) -> None:
-        assert self.sock is not None
-        while self.running:
-            try:
-                data, _addr = self.sock.recvfrom(4096)
-            except socket.timeout:
-                continue
-            except OSError:
-                break
-            payload = self._decode(data)
-            if not payload:
-                continue
-
-            msg_type = payload.get("type")
-            if msg_type == "room_request":
-                self._handle_request()
-            elif msg_type == "room_announce":
-                self._handle_announce(payload)
-            elif msg_type == "room_remove":
-                self._handle_remove(payload)
+    def _on_discovery_ready(self) -> None:
+        sock = self.sock
+        if sock is None:
+            return
+        try:
+            self._rx_batch.drain(sock, self._handle_datagram)
+        except OSError:
+            self.stop()
 
-        self.running = False
-        self.sock = None
+    def _handle_datagram(self, data: bytes) -> None:
+        payload = self._decode(data)
+        if not payload:
+            return
 
-    def _handle_request(self) -> None:
+        msg_type = payload.get("type")
+        if msg_type == "room_request":
+            self._handle_request(payload)
+        elif msg_type == "room_announce":
+            self._handle_announce(payload)
+        elif msg_type == "room_remove":
+            self._handle_remove(payload)
+
+    def _handle_request(self, payload: dict) -> None:
+        requester = str(payload.get("from", ""))
+        if requester == self.peer_id:
+            return  # our own request looped back
+        now = time.monotonic()
+        answered = self._answered
+        if now - answered.get(requester, float("-inf")) < self.REQUEST_DEDUP_SECONDS:
+            return  # another copy of a request we just answered
+        if len(answered) >= 256:
+            self._answered = answered = {
+                rid: ts for rid, ts in answered.items() if now - ts < self.REQUEST_DEDUP_SECONDS
+            }
+        answered[requester] = now
         with self.lock:
             rooms = list(self.local_rooms.values())
         for room in rooms:
@@ -178,13 +783,16 @@ class DiscoveryService:
         creator = str(payload.get("creator", ""))
         if not name or not creator:
             return
-        room = RoomEntry(name=name, port=port, private=private, creator=creator, code="")
+        room = RoomEntry(name, port, private, creator)
         key = self._room_key(room)
         with self.lock:
             existing = self.rooms.get(key)
             if existing and existing.creator == self.peer_id:
                 return
-            self.rooms[key] = room
+            # Peers re-announce every few seconds; only a real change is worth a UI refresh.
+            if existing and self._same_room(existing, room):
+                return
+            self._put_room(key, room)
         self._notify()
 
     def _handle_remove(self, payload: dict) -> None:
@@ -195,19 +803,43 @@ class DiscoveryService:
         name = str(payload.get("name", ""))
         creator = str(payload.get("creator", ""))
         private = bool(payload.get("private"))
-        room = RoomEntry(name=name, port=port, private=private, creator=creator)
+        room = RoomEntry(name, port, private, creator)
         key = self._room_key(room)
         with self.lock:
             # Ignore external remove attempts for rooms we own.
             if key in self.local_rooms and self.local_rooms[key].creator == self.peer_id:
                 return
-            removed = self.rooms.pop(key, None)
+            removed = self._pop_room(key)
             self.local_rooms.pop(key, None)
         if removed:
             self._notify()
 
-    def _room_key(self, room: RoomEntry) -> str:
-        return f"{room.name}|{room.port}"
+    def _put_room(self, key: tuple[str, int], room: RoomEntry) -> None:
+        # Caller holds self.lock.
+        self._pop_room(key)
+        self.rooms[key] = room
+        self._ordered.add(room)
+        self._rooms_gen += 1
+        if len(self.rooms) > MAX_ROOMS:
+            # Changed entries move to the end, so the first remote one is the stalest.
+            stale = next((k for k, r in self.rooms.items() if not r.local and k != key), None)
+            if stale is not None:
+                self._pop_room(stale)
+
+    def _pop_room(self, key: tuple[str, int]) -> Optional[RoomEntry]:
+        # Caller holds self.lock.
+        old = self.rooms.pop(key, None)
+        if old is not None:
+            self._ordered.remove(old)
+            self._rooms_gen += 1
+        return old
+
+    @staticmethod
+    def _same_room(a: RoomEntry, b: RoomEntry) -> bool:
+        return a.name == b.name and a.port == b.port and a.private == b.private and a.creator == b.creator
+
+    def _room_key(self, room: RoomEntry) -> tuple[str, int]:
+        return (room.name, room.port)
 
     def _notify(self) -> None:
         if self.on_rooms_changed:
@@ -234,18 +866,31 @@ class BroadcastPeer:
         self.on_typing = on_typing
         self.sock: Optional[socket.socket] = None
         self.running = False
-        self.thread: Optional[threading.Thread] = None
+        self.mux: Optional[PortMultiplexer] = None
         self.presence_thread: Optional[threading.Thread] = None
         self.peer_id = peer_id
         self.name = ""
         self.port = 0
         self.room = "public"
         self.code = ""
-        self.flood_windows: dict[str, deque] = {}
+        self._bcast_addr = (BROADCAST_ADDR, 0)
+        # Per-peer ring of the last flood_limit_count + 1 timestamps and its write index.
+        self.flood_windows: dict[str, list[float]] = {}
+        self.flood_indexes: dict[str, int] = {}
         self.flood_penalties: dict[str, float] = {}
         self.flood_limit_count = 5
         self.flood_limit_window = 3.0
         self.flood_penalty_seconds = 10.0
+        self._flood_sweep_at = 0.0
+        self._presence_bytes: Optional[bytes] = None
+        self._id_tail = b"}"
+        # Outgoing datagrams are assembled in place here rather than concatenated.
+        self._send_buf = bytearray(SEND_BUFSIZE)
+        self._send_view = memoryview(self._send_buf)
+        self._send_lock = threading.Lock()
+        self._room_tag = b""
+        self._code_tag = b""
+        self._self_tag = b'"id":' + _dumps(peer_id)
 
     def start(self, name: str, port: int, room: str, code: str) -> None:
         if self.running:
@@ -254,185 +899,230 @@ class BroadcastPeer:
         self.port = int(port)
         if not (1 <= self.port <= 65535):
             raise OSError("Invalid port (use 1-65535)")
+        self._bcast_addr = (BROADCAST_ADDR, self.port)
         self.room = room or "public"
         self.code = code.strip()
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        except (OSError, AttributeError):
-            pass
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        try:
-            sock.bind(("", self.port))
-        except OSError:
-            try:
-                sock.close()
-            except OSError:
-                pass
-            raise
-        sock.settimeout(1.0)
-        self.sock = sock
+        self._invalidate_cache()
+        self.mux = PortMultiplexer.attach(self.port, (self._room_tag, self._code_tag), self._handle_datagram)
+        self.sock = self.mux.sock
         self.running = True
-        self.thread = threading.Thread(target=self._recv_loop, daemon=True)
-        self.thread.start()
         self._send_system("joined the chat")
         self.presence_thread = threading.Thread(target=self._presence_loop, daemon=True)
         self.presence_thread.start()
 
     def send_chat(self, text: str) -> None:
-        self._send({"type": "chat", "text": text})
+        value = _try_dumps(text)
+        if value is not None:
+            self._send(b'{"type":"chat","text":', value)
 
     def send_typing(self, active: bool) -> None:
-        self._send({"type": "typing", "active": active})
+        self._send(b'{"type":"typing","active":true' if active else b'{"type":"typing","active":false', b"")
 
     def stop(self, announce: bool = True) -> None:
         if not self.running:
             return
         if announce:
             self._send_system("left the chat")
-        self.running = False
-        if self.sock is not None:
+        self._close_socket()
+
+    def farewell_packets(self) -> list[tuple[bytes, tuple[str, int]]]:
+        """The typing-off and "left the chat" datagrams that stop() would send."""
+        tail = self._id_tail
+        return [
+            (b'{"type":"typing","active":false' + tail, self._bcast_addr),
+            (b'{"type":"system","text":"left the chat"' + tail, self._bcast_addr),
+        ]
+
+    @staticmethod
+    def stop_all(peers: list["BroadcastPeer"]) -> None:
+        """Stop several peers, sending all their farewells in one batched syscall."""
+        running = [p for p in peers if p.running and p.sock is not None]
+        if running:
             try:
-                self.sock.close()
+                # Any bound broadcast socket will do; receivers only look at the destination port.
+                _send_batch(running[0].sock, [pkt for p in running for pkt in p.farewell_packets()])
             except OSError:
                 pass
-            self.sock = None
+        for peer in peers:
+            peer.stop(announce=False)
 
-    def _recv_loop(self) -> None:
-        assert self.sock is not None
-        while self.running:
-            try:
-                data, _addr = self.sock.recvfrom(4096)
-            except socket.timeout:
-                continue
-            except OSError:
-                break
-            payload = self._decode(data)
-            if not payload:
-                continue
-
-            peer_id = payload.get("id")
-            if peer_id == self.peer_id:
-                continue
+    def _close_socket(self) -> None:
+        self.running = False
+        if self.mux is not None:
+            self.mux.detach((self._room_tag, self._code_tag), self._handle_datagram)
+            self.mux = None
+        self.sock = None
 
-            msg_type = payload.get("type")
-            name = payload.get("name", "Unknown")
-            text = payload.get("text", "")
-            room = payload.get("room", "public")
-            code = payload.get("code", "")
+    def _handle_datagram(self, data: bytes) -> None:
+        # PortMultiplexer only delivers datagrams carrying this peer's room/code tags;
+        # our own broadcasts loop back and are dropped here, also before parsing.
+        if self._self_tag in data:
+            return
+        if not (self.on_message or self.on_presence or self.on_typing):
+            return  # nothing would consume it; don't even parse
+        payload = self._decode(data)
+        if not payload:
+            return
 
-            if room != self.room or code != self.code:
-                continue
+        peer_id = payload.get("id")
 
-            if msg_type == "presence" and self.on_presence:
-                try:
-                    self.on_presence(self.session_key, peer_id or "", name)
-                except Exception:
-                    pass
-                continue
+        msg_type = payload.get("type")
+        name = payload.get("name", "Unknown")
+        text = payload.get("text", "")
+        room = payload.get("room", "public")
+        code = payload.get("code", "")
 
-            if msg_type == "typing" and self.on_typing:
-                try:
-                    self.on_typing(self.session_key, peer_id or "", name, bool(payload.get("active", False)))
-                except Exception:
-                    pass
-                continue
+        if room != self.room or code != self.code:
+            return
 
-            if msg_type == "chat":
-                if self._is_flooding(peer_id or "", name):
-                    continue
-                display = f"{name}: {text}"
-            elif msg_type == "system":
-                if self._is_flooding(peer_id or "", name):
-                    continue
-                display = f"* {name} {text}"
-            else:
-                continue
-            if self.on_message:
-                try:
-                    self.on_message(self.session_key, display)
-                except Exception:
-                    pass
+        if msg_type == "presence" and self.on_presence:
+            try:
+                self.on_presence(self.session_key, peer_id or "", name)
+            except Exception:
+                pass
+            return
 
-        self.running = False
-        self.sock = None
+        if msg_type == "typing" and self.on_typing:
+            try:
+                self.on_typing(self.session_key, peer_id or "", name, bool(payload.get("active", False)))
+            except Exception:
+                pass
+            return
 
-    def _send(self, payload: dict) -> None:
-        if self.sock is None:
+        if not self.on_message:
             return
-        payload.update(
-            {
-                "id": self.peer_id,
-                "name": self.name,
-                "room": self.room,
-                "code": self.code,
-            }
-        )
-        data = self._encode(payload)
-        if data is None:
+        if msg_type == "chat":
+            if self._is_flooding(peer_id or "", name):
+                return
+            display = f"{name}: {text}"
+        elif msg_type == "system":
+            if self._is_flooding(peer_id or "", name):
+                return
+            display = f"* {name} {text}"
+        else:
             return
         try:
-            self.sock.sendto(data, ("<broadcast>", self.port))
+            self.on_message(self.session_key, display)
+        except Exception:
+            pass
+
+    def _send(self, head: bytes, value: bytes) -> None:
+        """Send head + value (an unterminated JSON object) followed by the pre-encoded identity fields."""
+        sock = self.sock
+        if sock is None:
+            return
+        tail = self._id_tail
+        mid = len(head) + len(value)
+        end = mid + len(tail)
+        try:
+            if end > SEND_BUFSIZE:
+                sock.sendto(head + value + tail, self._bcast_addr)
+                return
+            with self._send_lock:
+                buf = self._send_buf
+                # Equal-length slice assignment copies in place without resizing.
+                buf[: len(head)] = head
+                buf[len(head) : mid] = value
+                buf[mid:end] = tail
+                sock.sendto(self._send_view[:end], self._bcast_addr)
         except OSError:
             pass
 
     def _send_system(self, text: str) -> None:
-        self._send({"type": "system", "text": text})
+        value = _try_dumps(text)
+        if value is not None:
+            self._send(b'{"type":"system","text":', value)
+
+    def _invalidate_cache(self) -> None:
+        """Re-encode everything derived from the current name/room/code."""
+        self._id_tail = (
+            b',"id":' + _dumps(self.peer_id)
+            + b',"name":' + _dumps(self.name)
+            + b',"room":' + _dumps(self.room)
+            + b',"code":' + _dumps(self.code)
+            + b"}"
+        )
+        self._presence_bytes = b'{"type":"presence"' + self._id_tail
+        self._room_tag = b'"room":' + _dumps(self.room)
+        self._code_tag = b'"code":' + _dumps(self.code)
 
     def _presence_loop(self) -> None:
         while self.running:
-            if self.on_presence:
-                self.on_presence(self.session_key, self.peer_id, self.name)
-            self._send({"type": "presence"})
+            sock = self.sock
+            if sock is not None and self._presence_bytes is not None:
+                try:
+                    sock.sendto(self._presence_bytes, self._bcast_addr)
+                except OSError:
+                    pass
             time.sleep(5)
 
     def _is_flooding(self, peer_id: str, name: str) -> bool:
-        now = time.time()
+        now = time.monotonic()
+        if now >= self._flood_sweep_at:
+            self._sweep_flood_state(now)
         penalty_end = self.flood_penalties.get(peer_id, 0.0)
         if now < penalty_end:
             return True
-        window = self.flood_windows.setdefault(peer_id, deque())
-        while window and now - window[0] > self.flood_limit_window:
-            window.popleft()
-        window.append(now)
-        if len(window) > self.flood_limit_count:
+        ring = self.flood_windows.get(peer_id)
+        if ring is None:
+            ring = self.flood_windows[peer_id] = [float("-inf")] * (self.flood_limit_count + 1)
+        i = self.flood_indexes.get(peer_id, 0)
+        ring[i] = now
+        i = (i + 1) % len(ring)
+        self.flood_indexes[peer_id] = i
+        # ring[i] is now the oldest of the last limit + 1 messages.
+        if now - ring[i] <= self.flood_limit_window:
             self.flood_penalties[peer_id] = now + self.flood_penalty_seconds
             if self.on_message:
                 self.on_message(self.session_key, f"* Flood control: muting {name} for 10s")
             return True
         return False
 
-    def _encode(self, payload: dict) -> Optional[bytes]:
-        try:
-            raw = json.dumps(payload).encode("utf-8")
-        except (TypeError, ValueError):
-            return None
-        return base64.b64encode(raw)
+    def _sweep_flood_state(self, now: float) -> None:
+        """Forget peers quiet for a while and penalties that have run out, so the maps stay bounded."""
+        horizon = 10 * self.flood_limit_window
+        self._flood_sweep_at = now + horizon
+        for peer_id, ring in list(self.flood_windows.items()):
+            newest = ring[self.flood_indexes.get(peer_id, 0) - 1]
+            if now - newest > horizon:
+                del self.flood_windows[peer_id]
+                self.flood_indexes.pop(peer_id, None)
+        for peer_id, penalty_end in list(self.flood_penalties.items()):
+            if penalty_end <= now:
+                del self.flood_penalties[peer_id]
 
     def _decode(self, data: bytes) -> Optional[dict]:
         try:
-            decoded = base64.b64decode(data)
-            return json.loads(decoded.decode("utf-8"))
-        except Exception:
+            payload = _loads(data)
+        except ValueError:
             return None
+        return payload if isinstance(payload, dict) else None
 
 
-def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
-    """Receive exactly n bytes from a TCP socket, or None if EOF."""
-    data = b""
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
+def _recv_exact(sock: socket.socket, view: memoryview, started: bool = False) -> bool:
+    """Fill view from a TCP socket; False on EOF.
+
+    A timeout is raised only while nothing of the frame has arrived yet (started is
+    False); once a frame is under way we keep reading so the stream stays in sync.
+    """
+    got = 0
+    while got < len(view):
+        try:
+            chunk = sock.recv_into(view[got:])
+        except socket.timeout:
+            if started or got:
+                continue
+            raise
         if not chunk:
-            return None
-        data += chunk
-    return data
+            return False
+        got += chunk
+    return True
 
 
 class RelayPeer:
     """Sends/receives messages via a TCP relay server (for cross-campus testing).
 
-    Frames are length-prefixed: 4-byte big-endian length + payload bytes (Base64 JSON).
+    Frames are length-prefixed: 4-byte big-endian length + payload bytes (UTF-8 JSON).
     """
 
     def __init__(
@@ -457,11 +1147,23 @@ class RelayPeer:
         self.port = 0
         self.room = "public"
         self.code = ""
+        # The UI applies the same outgoing flood limits as BroadcastPeer.
+        self.flood_limit_count = 5
+        self.flood_limit_window = 3.0
+        self.flood_penalty_seconds = 10.0
 
         self.sock: Optional[socket.socket] = None
         self.running = False
         self.thread: Optional[threading.Thread] = None
         self.presence_thread: Optional[threading.Thread] = None
+        # Frame receive buffer, reused across frames and grown on demand up to MAX_FRAME.
+        self._rx = bytearray(RECV_BUFSIZE)
+        # Complete presence frame, built in start() once the identity is known.
+        self._presence_frame = b""
+        self._room_tag = b""
+        self._code_tag = b""
+        # The UI and presence threads share one stream; whole frames must not interleave.
+        self._send_lock = threading.Lock()
 
     def start(self, name: str, port: int, room: str, code: str) -> None:
         if self.running:
@@ -470,11 +1172,20 @@ class RelayPeer:
         self.port = int(port)  # kept for compatibility with UI/session keys
         self.room = room or "public"
         self.code = code.strip()
+        # Frames from other rooms on the same relay are dropped by these before decoding.
+        self._room_tag = b'"room":' + _dumps(self.room)
+        self._code_tag = b'"code":' + _dumps(self.code)
+        presence = self._encode(self._with_identity({"type": "presence"})) or b""
+        self._presence_frame = _FRAME_HEADER.pack(len(presence)) + presence
 
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _tune_buffers(sock)
+        # Chat frames are small; don't let Nagle hold them back waiting for an ACK.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         sock.settimeout(6.0)
         sock.connect((self.relay_host, self.relay_port))
-        sock.settimeout(1.0)
+        # Only bounds a stalled send; stop() unblocks the reader with shutdown().
+        sock.settimeout(RELAY_TIMEOUT)
 
         self.sock = sock
         self.running = True
@@ -490,14 +1201,20 @@ class RelayPeer:
         if announce:
             self._send_system("left the chat")
         self.running = False
-        if self.sock is not None:
+        # The reader clears self.sock as it exits, which can happen as soon as we shut down.
+        sock, self.sock = self.sock, None
+        if sock is not None:
             try:
-                self.sock.close()
+                # close() alone does not wake a thread blocked in recv on Linux.
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                sock.close()
             except OSError:
                 pass
-        self.sock = None
 
-    def send_text(self, text: str) -> None:
+    def send_chat(self, text: str) -> None:
         self._send({"type": "chat", "text": text})
 
     def send_typing(self, active: bool) -> None:
@@ -505,26 +1222,32 @@ class RelayPeer:
 
     def _encode(self, payload: dict) -> Optional[bytes]:
         try:
-            return base64.b64encode(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+            return _dumps(payload)
         except Exception:
             return None
 
     def _decode(self, data: bytes) -> Optional[dict]:
         try:
-            decoded = base64.b64decode(data)
-            return json.loads(decoded.decode("utf-8"))
+            payload = _loads(data)
         except Exception:
             return None
+        return payload if isinstance(payload, dict) else None
 
     def _send_frame(self, data: bytes) -> None:
-        if self.sock is None:
+        sock = self.sock
+        if sock is None:
             return
-        header = struct.pack("!I", len(data))
-        self.sock.sendall(header + data)
+        header = _FRAME_HEADER.pack(len(data))
+        with self._send_lock:
+            if not hasattr(sock, "sendmsg"):  # Windows
+                sock.sendall(header + data)
+                return
+            # Gather header and payload in one syscall; only a short write pays for a join.
+            sent = sock.sendmsg((header, data))
+            if sent < len(header) + len(data):
+                sock.sendall((header + data)[sent:])
 
-    def _send(self, payload: dict) -> None:
-        if self.sock is None:
-            return
+    def _with_identity(self, payload: dict) -> dict:
         payload.update(
             {
                 "id": self.peer_id,
@@ -533,7 +1256,12 @@ class RelayPeer:
                 "code": self.code,
             }
         )
-        data = self._encode(payload)
+        return payload
+
+    def _send(self, payload: dict) -> None:
+        if self.sock is None:
+            return
+        data = self._encode(self._with_identity(payload))
         if data is None:
             return
         try:
@@ -546,27 +1274,35 @@ class RelayPeer:
 
     def _presence_loop(self) -> None:
         while self.running:
-            if self.on_presence:
+            sock = self.sock
+            if sock is not None:
                 try:
-                    self.on_presence(self.session_key, self.peer_id, self.name)
-                except Exception:
+                    with self._send_lock:
+                        sock.sendall(self._presence_frame)
+                except OSError:
                     pass
-            self._send({"type": "presence"})
             time.sleep(5)
 
     def _recv_loop(self) -> None:
-        assert self.sock is not None
+        sock = self.sock
+        assert sock is not None
         while self.running:
             try:
-                header = _recv_exact(self.sock, 4)
-                if not header:
+                if not _recv_exact(sock, memoryview(self._rx)[:4]):
                     break
-                (n,) = struct.unpack("!I", header)
-                if n <= 0 or n > 1024 * 1024:
+                (n,) = _FRAME_HEADER.unpack_from(self._rx)
+                if n <= 0 or n > MAX_FRAME:
                     break
-                data = _recv_exact(self.sock, n)
-                if not data:
+                if n > len(self._rx):
+                    self._rx = bytearray(n)
+                view = memoryview(self._rx)[:n]
+                if not _recv_exact(sock, view, started=True):
                     break
+                if not (self.on_message or self.on_presence or self.on_typing):
+                    continue  # nothing would consume it; don't even copy it out
+                data = bytes(view)
+                if self._room_tag not in data or self._code_tag not in data:
+                    continue
             except socket.timeout:
                 continue
             except OSError:
@@ -603,6 +1339,8 @@ class RelayPeer:
                     pass
                 continue
 
+            if not self.on_message:
+                continue
             if msg_type == "chat":
                 display = f"{name}: {text}"
             elif msg_type == "system":
@@ -610,12 +1348,12 @@ class RelayPeer:
             else:
                 continue
 
-            if self.on_message:
-                try:
-                    self.on_message(self.session_key, display)
-                except Exception:
-                    pass
+            try:
+                self.on_message(self.session_key, display)
+            except Exception:
+                pass
 
         self.running = False
-        self.sock = None
+        if self.sock is sock:
+            self.sock = None
 
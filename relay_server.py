@@ -3,7 +3,7 @@
 
 Protocol: length-prefixed frames
 - 4-byte big-endian length N
-- N bytes payload (Base64-encoded JSON), forwarded as-is to other clients
+- N bytes payload (UTF-8 JSON), forwarded as-is to other clients
 
 Run:
   python relay_server.py --host 0.0.0.0 --port 9000
@@ -16,86 +16,163 @@ Then clients:
 from __future__ import annotations
 
 import argparse
+import selectors
 import socket
 import struct
-import threading
-from typing import List
+import time
 
 
-def recv_exact(conn: socket.socket, n: int) -> bytes | None:
-    data = b""
-    while len(data) < n:
-        chunk = conn.recv(n - len(data))
-        if not chunk:
-            return None
-        data += chunk
-    return data
+MAX_FRAME = 1024 * 1024
+# A client that stops reading is dropped once this much output is queued for it.
+MAX_PENDING = 4 * 1024 * 1024
+# Clients send presence every 5 s; one silent for this long is considered gone.
+IDLE_TIMEOUT = 30.0
+
+_HEADER = struct.Struct("!I")
+
+
+class _Client:
+    """Per-connection state: a reusable frame buffer and any output the kernel hasn't taken yet."""
+
+    __slots__ = ("sock", "addr", "buf", "got", "need", "out", "last_rx")
+
+    def __init__(self, sock: socket.socket, addr) -> None:
+        self.sock = sock
+        self.addr = addr
+        self.buf = bytearray(4096)
+        self.got = 0
+        self.need = _HEADER.size  # header first, then header + payload
+        self.out = bytearray()
+        self.last_rx = time.monotonic()
 
 
 class RelayServer:
+    """Single-threaded relay: one selector multiplexes the listener and every client."""
+
     def __init__(self, host: str, port: int) -> None:
         self.host = host
         self.port = port
-        self.clients: List[socket.socket] = []
-        self.lock = threading.Lock()
-
-    def broadcast(self, sender: socket.socket, frame: bytes) -> None:
-        with self.lock:
-            dead = []
-            for c in self.clients:
-                if c is sender:
-                    continue
-                try:
-                    c.sendall(frame)
-                except OSError:
-                    dead.append(c)
-            for d in dead:
+        self.clients: dict[socket.socket, _Client] = {}
+        self.sel = selectors.DefaultSelector()
+
+    def broadcast(self, sender: socket.socket, frame: bytes | memoryview) -> None:
+        for c in list(self.clients.values()):
+            if c.sock is sender:
+                continue
+            if c.out:
+                # Keep frame order: queue behind what is already waiting.
+                c.out += frame
+            else:
                 try:
-                    d.close()
+                    sent = c.sock.send(frame)
+                except BlockingIOError:
+                    sent = 0
                 except OSError:
-                    pass
-                if d in self.clients:
-                    self.clients.remove(d)
-
-    def handle(self, conn: socket.socket, addr) -> None:
-        with self.lock:
-            self.clients.append(conn)
+                    self.drop(c)
+                    continue
+                if sent == len(frame):
+                    continue
+                c.out += frame[sent:]
+                self.sel.modify(c.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, c)
+            if len(c.out) > MAX_PENDING:
+                self.drop(c)
+
+    def drop(self, c: _Client) -> None:
+        if self.clients.pop(c.sock, None) is None:
+            return
+        try:
+            self.sel.unregister(c.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            c.sock.close()
+        except OSError:
+            pass
+        print(f"[-] client {c.addr}")
 
+    def _accept(self, srv: socket.socket) -> None:
         try:
-            while True:
-                header = recv_exact(conn, 4)
-                if not header:
-                    break
-                (n,) = struct.unpack("!I", header)
-                if n <= 0 or n > 1024 * 1024:
-                    break
-                payload = recv_exact(conn, n)
-                if not payload:
-                    break
-                self.broadcast(conn, header + payload)
-        finally:
-            with self.lock:
-                if conn in self.clients:
-                    self.clients.remove(conn)
-            try:
-                conn.close()
-            except OSError:
-                pass
+            conn, addr = srv.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        c = _Client(conn, addr)
+        self.clients[conn] = c
+        self.sel.register(conn, selectors.EVENT_READ, c)
+        print(f"[+] client {addr}")
+
+    def _read(self, c: _Client) -> None:
+        try:
+            n = c.sock.recv_into(memoryview(c.buf)[c.got : c.need])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.drop(c)
+            return
+        if not n:
+            self.drop(c)
+            return
+        c.last_rx = time.monotonic()
+        c.got += n
+        if c.got < c.need:
+            return
+        if c.need == _HEADER.size:
+            (size,) = _HEADER.unpack_from(c.buf)
+            if size <= 0 or size > MAX_FRAME:
+                self.drop(c)
+                return
+            c.need += size
+            if c.need > len(c.buf):
+                c.buf.extend(bytes(c.need - len(c.buf)))
+            return
+        frame = memoryview(c.buf)[: c.need]
+        c.got = 0
+        c.need = _HEADER.size
+        self.broadcast(c.sock, frame)
+        frame.release()
+
+    def _write(self, c: _Client) -> None:
+        try:
+            sent = c.sock.send(c.out)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.drop(c)
+            return
+        del c.out[:sent]
+        if not c.out:
+            self.sel.modify(c.sock, selectors.EVENT_READ, c)
+
+    def _reap_idle(self, now: float) -> None:
+        for c in [c for c in self.clients.values() if now - c.last_rx > IDLE_TIMEOUT]:
+            self.drop(c)
 
     def serve(self) -> None:
         srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         srv.bind((self.host, self.port))
         srv.listen()
+        srv.setblocking(False)
+        self.sel.register(srv, selectors.EVENT_READ, None)
         print(f"[*] Relay listening on {self.host}:{self.port}")
 
         try:
             while True:
-                conn, addr = srv.accept()
-                conn.settimeout(30.0)
-                print(f"[+] client {addr}")
-                threading.Thread(target=self.handle, args=(conn, addr), daemon=True).start()
+                for key, mask in self.sel.select(timeout=1.0):
+                    c = key.data
+                    if c is None:
+                        self._accept(srv)
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read(c)
+                    if mask & selectors.EVENT_WRITE and c.sock in self.clients:
+                        self._write(c)
+                self._reap_idle(time.monotonic())
         finally:
+            for c in list(self.clients.values()):
+                self.drop(c)
+            self.sel.close()
             try:
                 srv.close()
             except OSError: